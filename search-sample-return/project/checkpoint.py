@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from clearance import ClearanceMap
+from frontier import FrontierIndex
+from tiled_map import TiledWorldMap, map_blocks
+
+# Name of the snapshot file, replaced atomically on every write
+CHECKPOINT_FILE = 'latest.npz'
+
+# Rover fields saved with the worldmap
+COUNTER_FIELDS = ('stuck_count', 'stuck_in_stuck_counter', 'cut_out_count',
+                  'steer_cut_index')
+
+
+# =====================================================
+# ---> Snapshots
+# =====================================================
+
+
+def rover_state(Rover):
+    """Returns the Rover's state (without the worldmap) as a JSON string."""
+    state = {field: getattr(Rover, field) for field in COUNTER_FIELDS}
+    state['total_time'] = Rover.total_time or 0
+    state['home_pos'] = Rover.home_pos
+    state['samples_to_find'] = Rover.samples_to_find
+    state['samples_seen'] = sorted(Rover.samples_seen)
+    state['samples_picked'] = sorted(Rover.samples_picked)
+    return json.dumps(state, default=float)
+
+
+class Checkpointer:
+    """Periodically snapshots the worldmap & Rover state to a compressed
+    file. The control path only copies the worldmap into a spare buffer,
+    compressing and writing happen in a background thread."""
+
+    def __init__(self, directory, interval=10.0):
+        self.path = os.path.join(directory, CHECKPOINT_FILE)
+        self.interval = interval  # Seconds between snapshots
+        self.last_time = time.time()
+        self.buffer = None  # Spare copy of a dense worldmap
+        self.pending = None  # Snapshot handed to the writer
+        self.ready = threading.Event()  # Set when a snapshot is pending
+        self.idle = threading.Event()  # Set when the writer is done
+        self.idle.set()
+        os.makedirs(directory, exist_ok=True)
+
+        # The server does not monkey patch, so this is a real OS thread
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    def maybe_snapshot(self, Rover):
+        """Hands a snapshot to the writer if the interval has passed.
+        Skipped while the previous snapshot is still being written."""
+        now = time.time()
+        if now - self.last_time < self.interval or not self.idle.is_set():
+            return False
+        self.last_time = now
+
+        snapshot = {'state': np.array(rover_state(Rover))}
+        if isinstance(Rover.worldmap, TiledWorldMap):
+            # Copy on write is not available for the tiles, so copy them all
+            keys = list(Rover.worldmap.tiles)
+            snapshot['world_size'] = np.array(Rover.worldmap.world_size)
+            snapshot['tile_keys'] = np.array(keys, dtype=int)
+            snapshot['tiles'] = np.array([Rover.worldmap.tiles[key] for key in keys])
+        else:
+            if self.buffer is None or self.buffer.shape != Rover.worldmap.shape:
+                self.buffer = np.empty_like(Rover.worldmap)
+            np.copyto(self.buffer, Rover.worldmap)
+            snapshot['worldmap'] = self.buffer
+
+        self.idle.clear()
+        self.pending = snapshot
+        self.ready.set()
+        return True
+
+    def writer(self):
+        while True:
+            self.ready.wait()
+            self.ready.clear()
+            try:
+                # Write to a temporary file first so a crash never
+                # leaves a truncated snapshot behind
+                tmp_path = self.path + '.tmp.npz'
+                np.savez_compressed(tmp_path, **self.pending)
+                os.replace(tmp_path, self.path)
+            except OSError as error:
+                print("Checkpoint failed: {}".format(error))
+            finally:
+                self.pending = None
+                self.idle.set()
+
+
+# =====================================================
+# ---> Resume
+# =====================================================
+
+
+def load_checkpoint(directory, Rover):
+    """Restores the worldmap & Rover state from the latest snapshot in
+    directory. Returns False if there is none."""
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return False
+
+    with np.load(path) as snapshot:
+        if 'tile_keys' in snapshot:
+            worldmap = TiledWorldMap(int(snapshot['world_size']))
+            for key, tile in zip(snapshot['tile_keys'], snapshot['tiles']):
+                worldmap.tiles[int(key)] = tile
+            worldmap.rebuild_overview()
+        else:
+            worldmap = snapshot['worldmap']
+        state = json.loads(str(snapshot['state']))
+
+    Rover.worldmap = worldmap
+    for field in COUNTER_FIELDS:
+        setattr(Rover, field, state[field])
+    Rover.time_offset = state['total_time']
+    Rover.home_pos = tuple(state['home_pos']) if state['home_pos'] else None
+    # Snapshots from before samples_to_find was saved leave it to the simulator
+    Rover.samples_to_find = state.get('samples_to_find', 0)
+    Rover.samples_seen = set(state['samples_seen'])
+    Rover.samples_picked = set(state['samples_picked'])
+
+    # Rebuild the frontier & clearance from the restored map
+    Rover.frontier = FrontierIndex(worldmap.shape[0])
+    Rover.clearance = ClearanceMap(worldmap.shape[0],
+                                   tiled=isinstance(worldmap, TiledWorldMap))
+    for y0, x0, block in map_blocks(worldmap):
+        ys, xs = np.indices(block.shape[:2])
+        Rover.frontier.update(worldmap, (ys + y0).ravel(), (xs + x0).ravel())
+        Rover.clearance.update(worldmap, (ys + y0).ravel(), (xs + x0).ravel())
+    return True
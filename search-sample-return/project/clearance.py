@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+
+from frontier import known_cells, navigable_cells
+from tiled_map import TiledWorldMap
+
+
+# =====================================================
+# ---> Obstacle Clearance Map
+# =====================================================
+
+
+class ClearanceMap:
+    """Distance (in cells) from every worldmap cell to the nearest mapped
+    obstacle, capped at max_dist. Only the cells within max_dist of the
+    cells touched by perception_step() are recomputed, with a distance
+    transform over a window large enough to be exact for them.
+
+    Stored as closeness (max_dist - clearance), so the unwritten cells
+    of a tiled map read as far from any obstacle."""
+
+    def __init__(self, world_size, max_dist=10, tiled=False):
+        self.world_size = world_size
+        self.max_dist = max_dist
+        if tiled:
+            self.closeness = TiledWorldMap(world_size, channels=1)
+        else:
+            self.closeness = np.zeros((world_size, world_size, 1), dtype=np.float32)
+
+    def update(self, worldmap, ys, xs):
+        """Recomputes the clearance around the touched cells (ys, xs)."""
+        if len(ys) == 0:
+            return
+        size, reach = self.world_size, self.max_dist
+
+        # Cells whose clearance may have changed ...
+        y0, y1 = max(ys.min() - reach, 0), min(ys.max() + reach + 1, size)
+        x0, x1 = max(xs.min() - reach, 0), min(xs.max() + reach + 1, size)
+        # ... and the cells that may hold their nearest obstacle
+        wy0, wy1 = max(y0 - reach, 0), min(y1 + reach, size)
+        wx0, wx1 = max(x0 - reach, 0), min(x1 + reach, size)
+
+        win_ys, win_xs = np.mgrid[wy0:wy1, wx0:wx1]
+        win_ys, win_xs = win_ys.ravel(), win_xs.ravel()
+        obstacle = known_cells(worldmap, win_ys, win_xs) \
+            & ~navigable_cells(worldmap, win_ys, win_xs)
+        free = (~obstacle).reshape(wy1 - wy0, wx1 - wx0).astype(np.uint8)
+        dist = cv2.distanceTransform(free, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+
+        dist = dist[y0 - wy0:y1 - wy0, x0 - wx0:x1 - wx0]
+        cell_ys, cell_xs = np.mgrid[y0:y1, x0:x1]
+        self.closeness[cell_ys.ravel(), cell_xs.ravel(), 0] = \
+            reach - np.minimum(dist, reach).ravel()
+
+    def clearance_at(self, x, y):
+        """Clearance (cells) of the world position (x, y). Outside of
+        the world counts as an obstacle."""
+        ix, iy = int(x), int(y)
+        if not (0 <= ix < self.world_size and 0 <= iy < self.world_size):
+            return 0.0
+        return self.max_dist - float(self.closeness[iy, ix, 0])
@@ -1,5 +1,87 @@
 import numpy as np
 
+from perception import NAV_HIST_CENTERS
+from planner import DStarLite
+
+
+# =====================================================
+# ---> Steering Angles
+# =====================================================
+
+
+def nav_mean_angle(Rover):
+    """Mean angle (degrees) of the navigable terrain pixels,
+    computed from the angular histogram built in perception.py."""
+    if Rover.nav_count == 0:
+        return 0.0
+    return np.dot(Rover.nav_hist_counts, NAV_HIST_CENTERS) / Rover.nav_count
+
+
+def widest_gap_angle(Rover):
+    """Mean angle (degrees) of the widest run of free histogram bins:
+    holding at least Rover.gap_min_count navigable pixels at a mean
+    distance of at least Rover.gap_min_dist, so bins blocked close ahead
+    do not count. Falls back to the mean angle if no bin is free."""
+    counts = Rover.nav_hist_counts
+    free = (counts >= Rover.gap_min_count) & (Rover.nav_hist_dists >= Rover.gap_min_dist)
+    free = np.concatenate(([0], free, [0]))
+    # Start & end bin of each run of free bins
+    edges = np.flatnonzero(np.diff(free))
+    if len(edges) == 0:
+        return nav_mean_angle(Rover)
+    starts, ends = edges[::2], edges[1::2]
+    widest = np.argmax(ends - starts)
+    gap = slice(starts[widest], ends[widest])
+    return np.dot(counts[gap], NAV_HIST_CENTERS[gap]) / counts[gap].sum()
+
+
+def frontier_target(Rover):
+    """World position (x, y) of the centroid of the largest unexplored
+    frontier, or None if there is none. Clusters the whole frontier,
+    so only called when entering cut_out mode."""
+    largest = Rover.frontier.largest(min_size=Rover.frontier_min_size)
+    if largest is None:
+        return None
+    return largest[0]
+
+
+def frontier_bias(Rover):
+    """Steering correction (degrees) toward the nearest frontier cell at
+    least Rover.frontier_min_dist away, so exploring keeps heading for
+    unmapped terrain. 0 once nothing is left to explore."""
+    target = Rover.frontier.nearest(Rover.pos[0], Rover.pos[1], Rover.frontier_min_dist)
+    if target is None:
+        return 0.0
+    return Rover.frontier_gain * angle_to(Rover, *target)
+
+
+def nav_steer_angle(Rover):
+    """Steering angle (degrees, unclipped) toward the navigable terrain
+    according to Rover.steer_mode."""
+    if Rover.steer_mode == 'widest_gap':
+        return widest_gap_angle(Rover)
+    return nav_mean_angle(Rover)
+
+
+def clearance_bias(Rover):
+    """Steering correction (degrees) toward the side with more obstacle
+    clearance, probed ahead of the Rover on both sides of its heading.
+    0 when both sides are clear."""
+    clearances = []
+    for side in (1, -1):
+        angle = (Rover.yaw + side * Rover.clearance_probe_angle) * np.pi / 180
+        clearances.append(Rover.clearance.clearance_at(
+            Rover.pos[0] + Rover.clearance_probe_dist * np.cos(angle),
+            Rover.pos[1] + Rover.clearance_probe_dist * np.sin(angle)))
+    left, right = clearances
+    return Rover.clearance_gain * (left - right)
+
+
+def angle_to(Rover, x, y):
+    """Angle (degrees) from the Rover's heading to the world position (x, y)."""
+    bearing = np.arctan2(y - Rover.pos[1], x - Rover.pos[0])
+    return (bearing * 180 / np.pi - Rover.yaw + 180) % 360 - 180
+
 
 # =====================================================
 # ---> Set Forward
@@ -13,7 +95,7 @@ def set_forward(Rover):
     Rover.mode = 'forward'
 
     # Check the extent of navigable terrain
-    if len(Rover.nav_angles) >= Rover.stop_forward:
+    if Rover.nav_count >= Rover.stop_forward:
         Rover.brake = 0
         # If mode is forward, navigable terrain looks good
         # and velocity is below max, then throttle
@@ -23,12 +105,13 @@ def set_forward(Rover):
         else:  # Else coast
             Rover.throttle = 0
 
-        # Set steering to average angle clipped to the range +/- 15
-        Rover.steer = np.clip(
-            np.mean(Rover.nav_angles * 180 / np.pi), -15, 15)
+        # Set steering to average angle, away from close walls
+        # & toward unexplored terrain, clipped to the range +/- 15
+        Rover.steer = np.clip(nav_steer_angle(Rover) + clearance_bias(Rover)
+                              + frontier_bias(Rover), -15, 15)
 
     # If there's a lack of navigable terrain pixels then go to 'stop' mode
-    elif len(Rover.nav_angles) < Rover.stop_forward:
+    elif Rover.nav_count < Rover.stop_forward:
         # Set mode to "stop" and hit the brakes!
         Rover.throttle = 0
         # Set brake to stored brake value
@@ -60,19 +143,20 @@ def set_reverse(Rover):
         if Rover.stuck_in_stuck_counter >= 0.5:
             Rover.stuck_in_stuck_counter -= 0.5
 
-    # Required to prevent a Numpy RuntimeWarning
-    # If the rover is in front of an obstacle
-    # np.mean() cannot comput len(Rover.nav_angles)
-    if len(Rover.nav_angles) < Rover.go_forward:
-        Rover.steer = 0
-    elif Rover.stuck_in_stuck_counter >= 25:
+    # Reversing does not move the Rover either, e.g. wedged
+    # in a corner, so turn in place
+    if Rover.stuck_in_stuck_counter >= 25:
         Rover.steer = 15
         Rover.throttle = 0
+    # Steering from too few navigable pixels is just noise
+    # if the rover is in front of an obstacle
+    elif Rover.nav_count < Rover.go_forward:
+        Rover.steer = 0
     else:
         # Steer in the opposite direction as direction
         # that lead to getting stuck
         Rover.steer = -(np.clip(
-            np.mean(Rover.nav_angles * 180 / np.pi), -15, 15))
+            nav_steer_angle(Rover), -15, 15))
 
     if Rover.stuck_count >= 0.5:
         Rover.stuck_count -= 0.5
@@ -90,7 +174,7 @@ def set_reverse(Rover):
 
 
 def set_stop(Rover):
-    """Called when the len(Rover.nav_angles) < Rover.go_forward
+    """Called when the Rover.nav_count < Rover.go_forward
     Transitions to Forward mode when untrue."""
     Rover.mode = 'stop'
 
@@ -99,25 +183,31 @@ def set_stop(Rover):
         Rover.throttle = 0
         Rover.brake = Rover.brake_set
         Rover.steer = 0
+        Rover.stop_turn = None
 
     # If we're not moving (vel < 0.2) then do something else
     elif Rover.vel <= 0.2:
         # Now we're stopped and we have vision data to see if there's a path forward
-        if len(Rover.nav_angles) < Rover.go_forward:
+        if Rover.nav_count < Rover.go_forward:
             Rover.throttle = 0
             # Release the brake to allow turning
             Rover.brake = 0
-            Rover.steer = -15
+            # Turn toward the nearest frontier, chosen once per stop
+            # so the turn does not swing back & forth across it
+            if Rover.stop_turn is None:
+                Rover.stop_turn = 15 if frontier_bias(Rover) > 0 else -15
+            Rover.steer = Rover.stop_turn
 
         # If we're stopped but see sufficient navigable terrain in front then go!
-        if len(Rover.nav_angles) >= Rover.go_forward:
+        if Rover.nav_count >= Rover.go_forward:
             # Set throttle back to stored value
             Rover.throttle = Rover.throttle_set
             # Release the brake
             Rover.brake = 0
             # Set steer to mean angle
             Rover.steer = np.clip(
-                np.mean(Rover.nav_angles * 180 / np.pi), -17, 17)
+                nav_steer_angle(Rover), -17, 17)
+            Rover.stop_turn = None
             Rover.mode = 'forward'
             return Rover
 
@@ -129,24 +219,30 @@ def set_stop(Rover):
 
 def cut_out(Rover):
     """Improves Rover's navigation by cutting out of long turns.
-    The list: Rover.steer_cuts[] is unevenly distributed to give
-    a randomized approach. These random cuts allow the Rover to
+    Steers toward the largest unexplored frontier of the worldmap.
+    Without one, the list: Rover.steer_cuts[] is unevenly distributed
+    to give a randomized approach. These random cuts allow the Rover to
     eventual navigate the entire map."""
     Rover.mode = 'cut_out'
 
     # Prevent Rover from turning into an obstacle
     # when turning out of a circle
-    if len(Rover.nav_angles) < Rover.stop_forward:
+    if Rover.nav_count < Rover.stop_forward:
         Rover.mode = 'stop'
         return Rover
 
-    # Rover.steer_cuts is a list of negative & positive
-    # values. The list is used to give the Rover a
-    # randomized directional choice. Prevents the Rover
-    # from missing areas of the map & infinite circles.
-    if Rover.steer_cut_index >= len(Rover.steer_cuts):
-        Rover.steer_cut_index = 0
-    Rover.steer = Rover.steer_cuts[Rover.steer_cut_index]
+    # Head for the largest unexplored frontier if there is one
+    if Rover.cut_out_target is not None:
+        target_angle = angle_to(Rover, *Rover.cut_out_target)
+        Rover.steer = np.clip(target_angle, -15, 15)
+    else:
+        # Rover.steer_cuts is a list of negative & positive
+        # values. The list is used to give the Rover a
+        # randomized directional choice. Prevents the Rover
+        # from missing areas of the map & infinite circles.
+        if Rover.steer_cut_index >= len(Rover.steer_cuts):
+            Rover.steer_cut_index = 0
+        Rover.steer = Rover.steer_cuts[Rover.steer_cut_index]
 
     if Rover.cut_out_count >= 1.0:
         Rover.cut_out_count -= 1.0
@@ -168,8 +264,7 @@ def going_to_rock(Rover):
     Rover.mode = 'going_to_rock'
 
     # Pointing steer angles to the closest Rock
-    Rover.steer = np.clip(
-        np.mean(Rover.rock_angle * 180 / np.pi), -15, 15)
+    Rover.steer = np.clip(Rover.rock_angle * 180 / np.pi, -15, 15)
 
     # Slow Down & Prevent backwards movement
     if Rover.vel > 1 or Rover.vel < -0.03:
@@ -191,6 +286,29 @@ def going_to_rock(Rover):
         return Rover
 
 
+def rock_stuck(Rover):
+    """Called when the Rover got stuck on the way to a visible rock, e.g.
+    one seen across an obstacle. After Rover.rock_max_stuck times on the
+    same rock it is skipped for Rover.rock_give_up_time seconds, see
+    rocks_to_chase() in perception.py."""
+    target = Rover.rock_tracker.get(Rover.rock_target)
+    if target is None:
+        return
+    x, y = target['pos']
+    if Rover.rock_stuck_pos is not None and \
+            np.hypot(x - Rover.rock_stuck_pos[0], y - Rover.rock_stuck_pos[1]) < 3:
+        Rover.rock_stuck_count += 1
+    else:
+        Rover.rock_stuck_count = 1
+    Rover.rock_stuck_pos = (x, y)
+
+    if Rover.rock_stuck_count >= Rover.rock_max_stuck:
+        Rover.rocks_given_up.append((x, y, Rover.total_time + Rover.rock_give_up_time))
+        Rover.rock_stuck_count = 0
+        Rover.rock_stuck_pos = None
+        Rover.rock_target = None
+
+
 # =====================================================
 # ---> Picking up a Rock
 # =====================================================
@@ -208,6 +326,12 @@ def picking_rock(Rover):
         Rover.send_pickup = False
 
     if Rover.near_sample == 0:
+        # Stop tracking & remembering the collected rock
+        Rover.rock_tracker.remove_near(Rover.pos[0], Rover.pos[1], 3)
+        idx, dist = closest_sample(Rover, Rover.samples_seen - Rover.samples_picked)
+        if idx is not None and dist < 3:
+            Rover.samples_picked.add(idx)
+        Rover.rock_target = None
         # Do a short backup after picking rock
         # Prevents Rover from turning around
         # after picking a rock near a wall
@@ -216,6 +340,126 @@ def picking_rock(Rover):
         return Rover
 
 
+# =====================================================
+# ---> Going to a Goal
+# =====================================================
+
+
+def closest_sample(Rover, indices):
+    """Returns the index in Rover.samples_pos of the closest of the given
+    samples and its distance (meters), or (None, None)."""
+    if not indices:
+        return None, None
+    indices = sorted(indices)
+    dists = np.hypot(np.take(Rover.samples_pos[0], indices) - Rover.pos[0],
+                     np.take(Rover.samples_pos[1], indices) - Rover.pos[1])
+    closest = np.argmin(dists)
+    return indices[closest], dists[closest]
+
+
+def choose_goal(Rover):
+    """Returns the worldmap cell to drive to & the index of its sample:
+    the closest rock seen but not collected, or the start position once
+    all rocks are collected. Returns (None, None) if there is none.
+    The start position is skipped while it was found unreachable, until
+    Rover.home_retry_time, so the rover explores meanwhile."""
+    if 0 < Rover.samples_to_find <= Rover.samples_collected \
+            and Rover.total_time >= Rover.home_retry_time:
+        return (int(Rover.home_pos[0]), int(Rover.home_pos[1])), None
+
+    idx, _ = closest_sample(Rover, Rover.samples_seen - Rover.samples_picked)
+    if idx is None:
+        return None, None
+    return (int(Rover.samples_pos[0][idx]), int(Rover.samples_pos[1][idx])), idx
+
+
+def drop_goal(Rover, sample_idx):
+    """Gives up on the current goal: forgets the rock, or explores for
+    Rover.home_retry_delay seconds before planning home again."""
+    if sample_idx is not None:
+        Rover.samples_seen.discard(sample_idx)
+    else:
+        Rover.home_retry_time = Rover.total_time + Rover.home_retry_delay
+    Rover.planner = None
+    Rover.goal_stuck_count = 0
+
+
+def goal_stuck(Rover):
+    """Called when the Rover got stuck on the way to its goal. The path
+    runs along mapped cells, so it can clip obstacles the Rover cannot
+    get past. The goal is dropped after Rover.goal_max_stuck times."""
+    Rover.goal_stuck_count += 1
+    if Rover.goal_stuck_count >= Rover.goal_max_stuck:
+        drop_goal(Rover, choose_goal(Rover)[1])
+
+
+def going_to_goal(Rover):
+    """Drives along the path planned to a remembered rock or back to the
+    start position. Called from forward mode when choose_goal() has one.
+    Nearby rocks that become visible take over in perception.py."""
+    Rover.mode = 'going_to_goal'
+
+    goal, sample_idx = choose_goal(Rover)
+    if goal is None:
+        Rover.planner = None
+        Rover.mode = 'forward'
+        return Rover
+
+    # Plan incrementally, only a new goal needs a new planner
+    start = (int(Rover.pos[0]), int(Rover.pos[1]))
+    if Rover.planner is None or Rover.planner.goal != goal:
+        Rover.planner = DStarLite(Rover.worldmap, start, goal)
+        Rover.goal_stuck_count = 0
+    Rover.planner.move_start(start)
+    consistent = Rover.planner.compute(max_time=Rover.planner_budget)
+
+    if np.hypot(goal[0] - Rover.pos[0], goal[1] - Rover.pos[1]) < Rover.goal_reached_dist:
+        if sample_idx is None:
+            # Back home, mission complete
+            Rover.throttle = 0
+            Rover.brake = Rover.brake_set
+            Rover.steer = 0
+            return Rover
+        # The rock is not visible from here, so forget about it
+        Rover.samples_seen.discard(sample_idx)
+        Rover.mode = 'forward'
+        return Rover
+
+    waypoint = Rover.planner.waypoint(lookahead=Rover.goal_lookahead)
+    if waypoint is None:
+        if consistent:
+            # No path to the rock or home yet, explore & map more
+            drop_goal(Rover, sample_idx)
+            set_forward(Rover)
+            return Rover
+        # Wait for the plan to be ready
+        Rover.throttle = 0
+        Rover.brake = Rover.brake_set
+        return Rover
+
+    # Steer to the center of the waypoint cell
+    target_angle = angle_to(Rover, waypoint[0] + 0.5, waypoint[1] + 0.5)
+    Rover.brake = 0
+    if abs(target_angle) > 45:
+        # Turn in place toward the path
+        Rover.throttle = 0
+        Rover.steer = 15 if target_angle > 0 else -15
+        return Rover
+
+    if Rover.nav_count < Rover.stop_forward:
+        Rover.throttle = 0
+        Rover.steer = 0
+        Rover.mode = 'stop'
+        return Rover
+
+    if Rover.vel < Rover.max_vel:
+        Rover.throttle = Rover.throttle_set
+    else:
+        Rover.throttle = 0
+    Rover.steer = np.clip(target_angle, -15, 15)
+    return Rover
+
+
 # =====================================================
 # --->  THE MAIN() FUNCTION
 # =====================================================
@@ -226,8 +470,12 @@ def decision_step(Rover):
     NOTE: Based on the output of the perception_step() function.
     """
 
+    # Remember where the mission started
+    if Rover.home_pos is None and Rover.pos is not None:
+        Rover.home_pos = tuple(Rover.pos[:2])
+
     # Verify if Rover has vision data
-    if Rover.nav_angles is not None:
+    if Rover.nav_hist_counts is not None:
         # Check for Rover.mode status
 
         # ---> Reverse
@@ -255,6 +503,7 @@ def decision_step(Rover):
                 # Call the cut_out() function
                 if Rover.cut_out_count >= 50.0:
                     Rover.mode = 'cut_out'
+                    Rover.cut_out_target = frontier_target(Rover)
                     return Rover
                 # If going Forward, Vel > 1.8 AND Steering
                 # at -15 or 15: add to the counter
@@ -280,6 +529,11 @@ def decision_step(Rover):
                     if Rover.stuck_count >= 0.5:
                         Rover.stuck_count -= 0.5
 
+            # Drive to a remembered rock or back home if there is one
+            if choose_goal(Rover)[0] is not None:
+                Rover.mode = 'going_to_goal'
+                return Rover
+
             # If not stuck OR about to cut out, go forward
             set_forward(Rover)
 
@@ -289,6 +543,7 @@ def decision_step(Rover):
             # Checking if Rover is Stuck:
             if Rover.throttle == 0.2 and Rover.near_sample == 0:
                 if Rover.stuck_count >= 60.0:
+                    rock_stuck(Rover)
                     Rover.mode = 'reverse'
                     return Rover
                 elif Rover.vel < 0.05 and Rover.vel > -0.2:
@@ -298,6 +553,22 @@ def decision_step(Rover):
                         Rover.stuck_count -= 0.5
             going_to_rock(Rover)
 
+        # ---> Going to Goal
+        # ====================
+        elif Rover.mode == 'going_to_goal':
+            # Checking if Rover is Stuck:
+            if Rover.throttle == Rover.throttle_set:
+                if Rover.stuck_count >= 55.0:
+                    goal_stuck(Rover)
+                    Rover.mode = 'reverse'
+                    return Rover
+                elif Rover.vel < 0.06 and Rover.vel > -0.2:
+                    Rover.stuck_count += 1
+                else:
+                    if Rover.stuck_count >= 0.5:
+                        Rover.stuck_count -= 0.5
+            going_to_goal(Rover)
+
         # ---> Picking Rock
         # ====================
         elif Rover.mode == 'picking_rock':
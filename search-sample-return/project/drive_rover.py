@@ -3,101 +3,20 @@ import argparse
 import os
 import shutil
 import time
+from contextlib import nullcontext
 from datetime import datetime
 
 import eventlet
 import eventlet.wsgi
-import matplotlib.image as mpimg
 import numpy as np
 import socketio
-from flask import Flask
 
-from decision import decision_step
-# Import functions for perception and decision-making
-from perception import perception_step
-from supporting_functions import update_rover, create_output_images
-
-# Initialize socketio server and Flask application
+# Initialize socketio server
 # (learn more at: https://python-socketio.readthedocs.io/en/latest/)
 sio = socketio.Server()
-app = Flask(__name__)
-
-# Read in ground truth map and create 3-channel green version for overplotting
-# NOTE: images are read in by default with the origin (0, 0) in the upper left
-# and y-axis increasing downward.
-ground_truth = mpimg.imread('../calibration_images/map_bw.png')
-# This next line creates arrays of zeros in the red and blue channels
-# and puts the map into the green channel.  This is why the underlying
-# map output looks green in the display image
-ground_truth_3d = np.dstack(
-    (ground_truth * 0, ground_truth * 255, ground_truth * 0)).astype(float)
-
-
-# Define RoverState() class to retain rover state parameters
-class RoverState:
-    # Define RoverState() class to retain rover state parameters
-    def __init__(self):
-        self.start_time = None  # To record the start time of navigation
-        self.total_time = None  # To record total duration of navigation
-        self.img = None  # Current camera image
-        self.pos = None  # Current position (x, y)
-        self.yaw = None  # Current yaw angle
-        self.pitch = None  # Current pitch angle
-        self.roll = None  # Current roll angle
-        self.vel = None  # Current velocity
-        self.steer = 0  # Current steering angle
-        self.throttle = 0  # Current throttle value
-        self.brake = 0  # Current brake value
-        self.nav_angles = None  # Angles of navigable terrain pixels
-        self.rock_angle = None
-        self.nav_dists = None  # Distances of navigable terrain pixels
-        self.rock_dists = None
-        self.ground_truth = ground_truth_3d  # Ground truth worldmap
-        self.fps = 0
-        self.mode = 'forward'  # Current mode (can be forward or stop)
-        self.throttle_set = 0.4  # Throttle setting when accelerating
-        self.brake_set = 1  # Brake setting when braking
-        # The stop_forward and go_forward fields below represent total count
-        # of navigable terrain pixels.  This is a very crude form of knowing
-        # when you can keep going and when you should stop.  Feel free to
-        # get creative in adding new fields or modifying these!
-        self.stop_forward = 260  # Threshold to initiate stopping
-        self.go_forward = 275  # Threshold to go forward again
-        self.max_vel = 2.4  # Maximum velocity (meters/second)
-        # Image output from perception step
-        # Update this image to display your intermediate analysis steps
-        # on screen in autonomous mode
-        self.vision_image = np.zeros((160, 320, 3), dtype=float)
-        # Worldmap
-        # Update this image with the positions of navigable terrain
-        # obstacles and rock samples
-        self.worldmap = np.zeros((200, 200, 3), dtype=float)
-        self.samples_pos = None  # To store the actual sample positions
-        self.samples_to_find = 0  # To store the initial count of samples
-        self.samples_located = 0  # To store number of samples located on map
-        self.samples_collected = 0  # To count the number of samples collected
-        # Will be set to telemetry value data["near_sample"]
-        self.near_sample = 0
-        # Will be set to telemetry value data["picking_up"]
-        self.picking_up = 0
-        self.send_pickup = False  # Set to True to trigger rock pickup
-
-        # Helps clean up the console output
-        self.console_log_counter = 0
-
-        #  Counter to Check if Rover is Stuck
-        self.stuck_count = 0
-        self.stuck_in_stuck_counter = 0
-
-        # Counter to Check is ROver is stuck in a circle
-        self.cut_out_count = 0
-        # Used for randomized cutting out of large turns.
-        self.steer_cut_index = 0
-        self.steer_cuts = [14, 14, 14, 10, -14, -14]
-
-
-# Initialize the rover
-Rover = RoverState()
+
+# The rover, initialized once the server listens (see __main__)
+Rover = None
 
 # Variables to track frames per second (FPS)
 # Initialize frame counter
@@ -106,6 +25,18 @@ frame_counter = 0
 second_counter = time.time()
 fps = None
 
+# Periodic worldmap snapshots, enabled with --checkpoint-dir
+checkpointer = None
+# Per frame telemetry & decision recording, enabled with --record
+recorder = None
+# Runtime stack sampling & allocation tracking, enabled with --profile-dir
+profiler = None
+
+
+def section(name):
+    """Profiler section of the telemetry handler, if profiling is enabled."""
+    return profiler.section(name) if profiler is not None else nullcontext()
+
 
 # Define telemetry function for what to do with incoming data
 @sio.on('telemetry')
@@ -128,13 +59,18 @@ def telemetry(sid, data):
         Rover, image = update_rover(Rover, data)
 
         if np.isfinite(Rover.vel):
+            if profiler is not None:
+                profiler.tick()
 
             # Execute the perception and decision steps to update the Rover's state
-            Rover = perception_step(Rover)
-            Rover = decision_step(Rover)
+            with section('perception_step'):
+                Rover = perception_step(Rover)
+            with section('decision_step'):
+                Rover = decision_step(Rover)
 
             # Create output images to send to server
-            out_image_string1, out_image_string2 = create_output_images(Rover)
+            with section('create_output_images'):
+                out_image_string1, out_image_string2 = create_output_images(Rover)
 
             # The action step!  Send commands to the rover!
 
@@ -152,6 +88,12 @@ def telemetry(sid, data):
                 commands = (Rover.throttle, Rover.brake, Rover.steer)
                 send_control(commands, out_image_string1, out_image_string2)
 
+            # Snapshot after the commands are sent, off the control path
+            if checkpointer is not None:
+                checkpointer.maybe_snapshot(Rover)
+            if recorder is not None:
+                recorder.append(Rover)
+
         # In case of invalid telemetry, send null commands
         else:
 
@@ -218,8 +160,106 @@ if __name__ == '__main__':
         default='',
         help='Path to image folder. This is where the images from the run will be saved.'
     )
+    parser.add_argument(
+        '--roi',
+        action='store_true',
+        help='Only warp and classify the region of interest of the camera image.'
+    )
+    parser.add_argument(
+        '--world-size',
+        type=int,
+        default=0,
+        help='Use a lazily allocated tiled worldmap of this many cells per side.'
+    )
+    parser.add_argument(
+        '--checkpoint-dir',
+        type=str,
+        default='',
+        help='Folder to periodically save worldmap snapshots to.'
+    )
+    parser.add_argument(
+        '--checkpoint-interval',
+        type=float,
+        default=10.0,
+        help='Seconds between worldmap snapshots.'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Resume from the latest snapshot in the checkpoint folder.'
+    )
+    parser.add_argument(
+        '--record',
+        type=str,
+        default='',
+        help='Folder to record per frame telemetry and decisions to.'
+    )
+    parser.add_argument(
+        '--profile-dir',
+        type=str,
+        default='',
+        help='Folder for profiles, sampled on SIGUSR1 (SIGUSR2 toggles allocation tracking).'
+    )
+    parser.add_argument(
+        '--profile-port',
+        type=int,
+        default=0,
+        help='Also accept profiler commands on this localhost port.'
+    )
+    parser.add_argument(
+        '--profile-window',
+        type=float,
+        default=10.0,
+        help='Seconds of stack sampling per profile.'
+    )
     args = parser.parse_args()
 
+    # Listen first: the simulator's connection is queued by the OS
+    # while the heavy modules (OpenCV, Flask, ...) are imported below
+    listener = eventlet.listen(('', 4567))
+
+    from flask import Flask
+
+    # Import functions for perception and decision-making
+    from decision import decision_step
+    from perception import perception_step
+    from rover_state import RoverState
+    from supporting_functions import update_rover, create_output_images
+
+    # Initialize the rover
+    Rover = RoverState()
+    Rover.roi_only = args.roi
+    if args.world_size:
+        from clearance import ClearanceMap
+        from frontier import FrontierIndex
+        from tiled_map import TiledWorldMap
+        Rover.worldmap = TiledWorldMap(args.world_size)
+        Rover.frontier = FrontierIndex(args.world_size)
+        Rover.clearance = ClearanceMap(args.world_size, tiled=True)
+
+    if args.checkpoint_dir != '':
+        from checkpoint import Checkpointer, load_checkpoint
+        if args.resume:
+            if load_checkpoint(args.checkpoint_dir, Rover):
+                print("Resumed from {}".format(args.checkpoint_dir))
+            else:
+                print("No snapshot to resume from in {}".format(args.checkpoint_dir))
+        checkpointer = Checkpointer(args.checkpoint_dir, args.checkpoint_interval)
+
+    if args.record != '':
+        from flight_recorder import FlightRecorder
+        print("Recording telemetry to {}".format(args.record))
+        recorder = FlightRecorder(args.record)
+
+    if args.profile_dir != '':
+        from profiler import Profiler
+        profiler = Profiler(args.profile_dir)
+        if profiler.install_signals(args.profile_window):
+            print("Profiler: kill -USR1 {} to sample stacks".format(os.getpid()))
+        if args.profile_port:
+            profiler.serve(args.profile_port, args.profile_window)
+            print("Profiler listening on localhost:{}".format(args.profile_port))
+
     # os.system('rm -rf IMG_stream/*')
     if args.image_folder != '':
         print("Creating image folder at {}".format(args.image_folder))
@@ -233,7 +273,11 @@ if __name__ == '__main__':
         print("NOT recording this run ...")
 
     # wrap Flask application with socketio's middleware
-    app = socketio.Middleware(sio, app)
+    app = socketio.Middleware(sio, Flask(__name__))
 
     # deploy as an eventlet WSGI server
-    eventlet.wsgi.server(eventlet.listen(('', 4567)), app)
+    try:
+        eventlet.wsgi.server(listener, app)
+    finally:
+        if recorder is not None:
+            recorder.close()
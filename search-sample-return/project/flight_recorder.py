@@ -0,0 +1,157 @@
+import glob
+import os
+import threading
+import time
+
+import numpy as np
+
+# Recorded fields: (name, dtype, getter)
+FIELDS = (
+    ('time', np.float64, lambda Rover: time.time()),
+    ('total_time', np.float32, lambda Rover: Rover.total_time),
+    ('x', np.float32, lambda Rover: Rover.pos[0]),
+    ('y', np.float32, lambda Rover: Rover.pos[1]),
+    ('yaw', np.float32, lambda Rover: Rover.yaw),
+    ('pitch', np.float32, lambda Rover: Rover.pitch),
+    ('roll', np.float32, lambda Rover: Rover.roll),
+    ('vel', np.float32, lambda Rover: Rover.vel),
+    ('throttle', np.float32, lambda Rover: Rover.throttle),
+    ('brake', np.float32, lambda Rover: Rover.brake),
+    ('steer', np.float32, lambda Rover: Rover.steer),
+    ('send_pickup', np.uint8, lambda Rover: Rover.send_pickup),
+    ('mode', np.uint8, lambda Rover: mode_code(Rover.mode)),
+    ('nav_count', np.int32, lambda Rover: Rover.nav_count),
+    ('stuck_count', np.float32, lambda Rover: Rover.stuck_count),
+    ('stuck_in_stuck_counter', np.float32, lambda Rover: Rover.stuck_in_stuck_counter),
+    ('cut_out_count', np.float32, lambda Rover: Rover.cut_out_count),
+    ('steer_cut_index', np.int16, lambda Rover: Rover.steer_cut_index),
+    ('near_sample', np.uint8, lambda Rover: Rover.near_sample),
+    ('picking_up', np.uint8, lambda Rover: Rover.picking_up),
+    ('samples_collected', np.int16, lambda Rover: Rover.samples_collected),
+    ('fps', np.int16, lambda Rover: Rover.fps or 0),
+    ('map_accepted', np.int32, lambda Rover: Rover.map_accepted),
+    ('map_rejected_pose', np.int32, lambda Rover: Rover.map_rejected_pose),
+    ('map_rejected_stale', np.int32, lambda Rover: Rover.map_rejected_stale),
+)
+
+# Decision modes, recorded by their index in this tuple
+MODES = ('forward', 'stop', 'reverse', 'cut_out', 'going_to_rock',
+         'picking_rock', 'going_to_goal')
+UNKNOWN_MODE = 255
+
+
+def mode_code(mode):
+    return MODES.index(mode) if mode in MODES else UNKNOWN_MODE
+
+
+# =====================================================
+# ---> Flight Recorder
+# =====================================================
+
+
+class FlightRecorder:
+    """Records the telemetry & decisions of every frame into typed
+    per field arrays. Full chunks are written to disk as one columnar
+    .npz file by a background thread while recording continues into a
+    second set of arrays."""
+
+    def __init__(self, directory, chunk_size=4096):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.columns = self.allocate()
+        self.spare = self.allocate()
+        self.row = 0  # Next row of self.columns
+        self.chunk = 0  # Index of the next chunk file
+        self.dropped = 0  # Rows overwritten while the writer was busy
+        self.pending = None  # (chunk index, columns, rows) to write
+        self.ready = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        os.makedirs(directory, exist_ok=True)
+
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    def allocate(self):
+        return {name: np.zeros(self.chunk_size, dtype=dtype)
+                for name, dtype, _ in FIELDS}
+
+    def append(self, Rover):
+        """Records the current frame."""
+        row = self.row
+        for name, _, getter in FIELDS:
+            self.columns[name][row] = getter(Rover)
+        self.row += 1
+
+        if self.row == self.chunk_size:
+            if self.idle.is_set():
+                self.flush()
+            else:
+                # Writer still busy: keep going as a ring buffer
+                self.dropped += self.chunk_size
+                self.row = 0
+
+    def flush(self, wait=False):
+        """Hands the recorded rows to the writer and swaps the arrays."""
+        self.idle.wait()
+        if self.row == 0:
+            return
+        self.idle.clear()
+        self.pending = (self.chunk, self.columns, self.row)
+        self.columns, self.spare = self.spare, self.columns
+        self.chunk += 1
+        self.row = 0
+        self.ready.set()
+        if wait:
+            self.idle.wait()
+
+    def close(self):
+        """Writes the remaining rows to disk."""
+        self.flush(wait=True)
+
+    def writer(self):
+        while True:
+            self.ready.wait()
+            self.ready.clear()
+            chunk, columns, rows = self.pending
+            try:
+                path = os.path.join(self.directory, 'chunk_{:05d}.npz'.format(chunk))
+                np.savez(path, **{name: column[:rows] for name, column in columns.items()})
+            except OSError as error:
+                print("Flight recorder failed: {}".format(error))
+            finally:
+                self.pending = None
+                self.idle.set()
+
+
+# =====================================================
+# ---> Offline Loading
+# =====================================================
+
+
+def load_flight_record(directory):
+    """Loads all the chunks recorded in directory. Returns a dict of
+    per field arrays, with the modes decoded in 'mode_name'.
+    Fields missing from older chunks are filled with NaN (which turns
+    integer fields into floats)."""
+    chunks = []
+    for path in sorted(glob.glob(os.path.join(directory, 'chunk_*.npz'))):
+        with np.load(path) as chunk:
+            chunks.append({name: chunk[name] for name in chunk.files})
+
+    names = [name for name, _, _ in FIELDS]
+    names += sorted({name for chunk in chunks for name in chunk} - set(names))
+    dtypes = {name: dtype for name, dtype, _ in FIELDS}
+    record = {}
+    for name in names:
+        columns = []
+        for chunk in chunks:
+            rows = len(next(iter(chunk.values()))) if chunk else 0
+            columns.append(chunk[name] if name in chunk else np.full(rows, np.nan))
+        record[name] = np.concatenate(columns) if columns \
+            else np.zeros(0, dtype=dtypes.get(name, float))
+
+    modes = np.nan_to_num(record['mode'], nan=UNKNOWN_MODE).astype(int)
+    mode_names = np.array(MODES + ('unknown',))
+    record['mode_name'] = mode_names[np.minimum(modes, len(MODES))]
+    return record
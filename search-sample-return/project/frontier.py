@@ -0,0 +1,113 @@
+import numpy as np
+
+# Offsets of a cell and its 8 neighbours
+NEIGHBOURS_8 = np.array([(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)])
+# Offsets of the 4 direct neighbours of a cell
+NEIGHBOURS_4 = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)])
+
+
+# =====================================================
+# ---> Worldmap Cell States
+# =====================================================
+
+
+def known_cells(worldmap, ys, xs):
+    """True for the cells that were mapped as navigable or obstacle."""
+    return (worldmap[ys, xs, 0] > 0) | (worldmap[ys, xs, 2] > 0)
+
+
+def navigable_cells(worldmap, ys, xs):
+    """True for the cells more often seen navigable than as an obstacle."""
+    navigable = worldmap[ys, xs, 2]
+    return (navigable > 0) & (navigable >= worldmap[ys, xs, 0])
+
+
+# =====================================================
+# ---> Frontier Index
+# =====================================================
+
+
+class FrontierIndex:
+    """Set of the known navigable cells of the worldmap that are next to
+    unknown cells. Only the cells touched by perception_step() (and their
+    neighbours) are re-evaluated, the full map is never rescanned."""
+
+    def __init__(self, world_size):
+        self.world_size = world_size
+        self.cells = set()  # Flat indices (y * world_size + x) of frontier cells
+
+    def update(self, worldmap, ys, xs):
+        """Re-evaluates the touched cells (ys, xs) and their neighbours."""
+        if len(ys) == 0:
+            return
+        size = self.world_size
+
+        # Touched cells and their neighbours, without duplicates
+        near_ys = np.clip(ys[:, None] + NEIGHBOURS_8[:, 0], 0, size - 1)
+        near_xs = np.clip(xs[:, None] + NEIGHBOURS_8[:, 1], 0, size - 1)
+        flat = np.unique(near_ys * size + near_xs)
+        cell_ys, cell_xs = np.divmod(flat, size)
+
+        # A navigable cell is a frontier if any direct neighbour is unknown
+        next_to_unknown = np.zeros(len(flat), dtype=bool)
+        for dy, dx in NEIGHBOURS_4:
+            nb_ys, nb_xs = cell_ys + dy, cell_xs + dx
+            inside = (nb_ys >= 0) & (nb_ys < size) & (nb_xs >= 0) & (nb_xs < size)
+            unknown = ~known_cells(worldmap, np.clip(nb_ys, 0, size - 1),
+                                   np.clip(nb_xs, 0, size - 1))
+            next_to_unknown |= inside & unknown
+        is_frontier = navigable_cells(worldmap, cell_ys, cell_xs) & next_to_unknown
+
+        self.cells.difference_update(flat[~is_frontier].tolist())
+        self.cells.update(flat[is_frontier].tolist())
+
+    def positions(self):
+        """Returns the (x, y) world positions of all frontier cells."""
+        flat = np.fromiter(self.cells, dtype=int, count=len(self.cells))
+        ys, xs = np.divmod(flat, self.world_size)
+        return xs, ys
+
+    def nearest(self, x, y, min_dist=0):
+        """Returns the (x, y) of the frontier cell closest to (x, y)
+        that is at least min_dist away, or None."""
+        xs, ys = self.positions()
+        dists = np.hypot(xs - x, ys - y)
+        far_enough = dists >= min_dist
+        if not far_enough.any():
+            return None
+        closest = np.argmin(np.where(far_enough, dists, np.inf))
+        return xs[closest], ys[closest]
+
+    def clusters(self):
+        """Groups the frontier cells into 8-connected clusters.
+        Returns a list of flat index lists."""
+        size = self.world_size
+        unvisited = set(self.cells)
+        clusters = []
+        while unvisited:
+            stack = [unvisited.pop()]
+            cluster = []
+            while stack:
+                cell = stack.pop()
+                cluster.append(cell)
+                y, x = divmod(cell, size)
+                for dy, dx in NEIGHBOURS_8.tolist():
+                    nb_y, nb_x = y + dy, x + dx
+                    neighbour = nb_y * size + nb_x
+                    if 0 <= nb_y < size and 0 <= nb_x < size \
+                            and neighbour in unvisited:
+                        unvisited.remove(neighbour)
+                        stack.append(neighbour)
+            clusters.append(cluster)
+        return clusters
+
+    def largest(self, min_size=1):
+        """Returns the (x, y) centroid and the size of the largest
+        frontier cluster, or None if none has min_size cells."""
+        clusters = [cluster for cluster in self.clusters()
+                    if len(cluster) >= min_size]
+        if not clusters:
+            return None
+        cluster = max(clusters, key=len)
+        ys, xs = np.divmod(np.array(cluster), self.world_size)
+        return (xs.mean(), ys.mean()), len(cluster)
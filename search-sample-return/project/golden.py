@@ -0,0 +1,212 @@
+import argparse
+import importlib
+import os
+import time
+
+import cv2
+import numpy as np
+
+import perception
+from perception import calibration_points, update_worldmap
+from robot_log import iter_frames
+from rover_state import load_ground_truth
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_LOG = os.path.join(PROJECT_DIR, '..', '6_lab', 'test_dataset', 'robot_log.csv')
+DEFAULT_GOLDEN = os.path.join(PROJECT_DIR, '..', '6_lab', 'output', 'golden_outputs.npz')
+
+# Kernels checked by the harness, reference implementations in perception.py
+KERNELS = ('perspective_transform', 'color_thresh', 'find_rocks', 'rover_coords',
+           'to_polar_coords', 'pix_to_world')
+REFERENCE = {name: getattr(perception, name) for name in KERNELS}
+
+WORLD_SIZE = 200
+SCALE = 10
+
+
+# =====================================================
+# ---> Pipeline
+# =====================================================
+
+
+def load_frames(log_path):
+    """Yields the RGB camera image and pose (x, y, yaw) of each logged frame."""
+    for path, _, xpos, ypos, yaw in iter_frames(log_path):
+        yield cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB), (xpos, ypos, yaw)
+
+
+def run_pipeline(image, pose, kernels):
+    """Runs the mapping pipeline of perception_step() on one frame with
+    the given kernels. Returns the calls as a list of
+    (label, kernel name, args, outputs, seconds), outputs being a tuple."""
+    calls = []
+
+    def call(label, name, *args):
+        start = time.perf_counter()
+        outputs = kernels[name](*args)
+        elapsed = time.perf_counter() - start
+        outputs = outputs if isinstance(outputs, tuple) else (outputs,)
+        calls.append((label, name, args, outputs, elapsed))
+        return outputs
+
+    xpos, ypos, yaw = pose
+    source, destination = calibration_points(image.shape)
+    warped, mask = call('perspective_transform', 'perspective_transform',
+                        image, source, destination)
+    # The kernel's own output is checked, the rest of the pipeline uses
+    # it masked to the camera's view like perception_step()
+    threshed = call('color_thresh', 'color_thresh', warped)[0] * mask
+    call('find_rocks', 'find_rocks', warped)
+    obs_map = np.absolute(np.float32(threshed) - 1) * mask
+
+    xpix, ypix = call('rover_coords', 'rover_coords', threshed)
+    call('to_polar_coords', 'to_polar_coords', xpix, ypix)
+    call('pix_to_world', 'pix_to_world', xpix, ypix, xpos, ypos, yaw, WORLD_SIZE, SCALE)
+    obs_xpix, obs_ypix = call('rover_coords_obs', 'rover_coords', obs_map)
+    call('pix_to_world_obs', 'pix_to_world',
+         obs_xpix, obs_ypix, xpos, ypos, yaw, WORLD_SIZE, SCALE)
+    return calls
+
+
+def map_frame(worldmap, calls):
+    """Applies the worldmap updates of perception_step() for one frame."""
+    outputs = {label: outputs for label, _, _, outputs, _ in calls}
+    nav_x, nav_y = outputs['pix_to_world']
+    obs_x, obs_y = outputs['pix_to_world_obs']
+    update_worldmap(worldmap, (nav_y, nav_x), (obs_y, obs_x))
+
+
+def map_fidelity(worldmap):
+    """Returns the fidelity (% of the mapped navigable cells that are
+    navigable in map_bw.png) and the % of the ground truth mapped."""
+    truth = load_ground_truth()[0] > 0
+    mapped = worldmap[:, :, 2] > 0
+    good = np.count_nonzero(mapped & truth)
+    fidelity = 100 * good / max(np.count_nonzero(mapped), 1)
+    return fidelity, 100 * good / max(np.count_nonzero(truth), 1)
+
+
+# =====================================================
+# ---> Recording & Checking
+# =====================================================
+
+
+def record(log_path, golden_path):
+    """Records the outputs of the reference kernels on every frame."""
+    arrays = {}
+    index = -1
+    for index, (image, pose) in enumerate(load_frames(log_path)):
+        for label, _, _, outputs, _ in run_pipeline(image, pose, REFERENCE):
+            for number, output in enumerate(outputs):
+                arrays['f{:05d}.{}.{}'.format(index, label, number)] = output
+    os.makedirs(os.path.dirname(os.path.abspath(golden_path)), exist_ok=True)
+    np.savez_compressed(golden_path, **arrays)
+    return index + 1
+
+
+def matches(expected, actual, atol):
+    """Returns (equivalent, largest absolute difference)."""
+    actual = np.asarray(actual)
+    if expected.shape != actual.shape:
+        return False, np.inf
+    if expected.size == 0:
+        return True, 0.0
+    diff = np.abs(expected.astype(float) - actual.astype(float)).max()
+    return diff <= atol, diff
+
+
+def check(log_path, golden_path, variants, atol=0.0):
+    """Checks the current kernels & the variants (kernel name -> function)
+    against the golden outputs. Each variant runs on the reference inputs,
+    so a mismatch is its own. Returns per label statistics and the map
+    fidelity with the reference and with the variants."""
+    kernels = dict(REFERENCE, **variants)
+    stats = {}
+    reference_map = np.zeros((WORLD_SIZE, WORLD_SIZE, 3))
+    variant_map = np.zeros((WORLD_SIZE, WORLD_SIZE, 3))
+
+    with np.load(golden_path) as golden:
+        for index, (image, pose) in enumerate(load_frames(log_path)):
+            calls = run_pipeline(image, pose, REFERENCE)
+            map_frame(reference_map, calls)
+            map_frame(variant_map, run_pipeline(image, pose, kernels)
+                      if variants else calls)
+
+            for label, name, args, outputs, elapsed in calls:
+                entry = stats.setdefault(label, {
+                    'kernel': name, 'frames': 0, 'drifted': 0, 'mismatched': 0,
+                    'max_diff': 0.0, 'reference_time': 0.0, 'variant_time': 0.0})
+                entry['frames'] += 1
+                entry['reference_time'] += elapsed
+                expected = [golden['f{:05d}.{}.{}'.format(index, label, number)]
+                            for number in range(len(outputs))]
+                if not all(matches(want, got, 0)[0] for want, got in zip(expected, outputs)):
+                    entry['drifted'] += 1
+
+                if name in variants:
+                    start = time.perf_counter()
+                    variant_outputs = variants[name](*args)
+                    entry['variant_time'] += time.perf_counter() - start
+                    if not isinstance(variant_outputs, tuple):
+                        variant_outputs = (variant_outputs,)
+                    results = [matches(want, got, atol)
+                               for want, got in zip(expected, variant_outputs)]
+                    if len(variant_outputs) != len(expected) \
+                            or not all(ok for ok, _ in results):
+                        entry['mismatched'] += 1
+                    entry['max_diff'] = max([entry['max_diff']] + [diff for _, diff in results])
+
+    return stats, map_fidelity(reference_map), map_fidelity(variant_map)
+
+
+def load_variant(spec):
+    """Parses 'kernel=module:function' into (kernel, function)."""
+    name, target = spec.split('=')
+    if name not in KERNELS:
+        raise ValueError("Unknown kernel {}, expected one of {}".format(name, KERNELS))
+    module, function = target.split(':')
+    return name, getattr(importlib.import_module(module), function)
+
+
+def print_report(stats, reference_fidelity, variant_fidelity, variants):
+    print("{:<20} {:>6} {:>7} {:>10} {:>10} {:>8}".format(
+        'call', 'frames', 'drifted', 'mismatched', 'max diff', 'speedup'))
+    for label, entry in stats.items():
+        if entry['kernel'] in variants:
+            speedup = '{:.2f}x'.format(entry['reference_time'] / max(entry['variant_time'], 1e-9))
+            mismatched = entry['mismatched']
+            max_diff = '{:.3g}'.format(entry['max_diff'])
+        else:
+            speedup = mismatched = max_diff = '-'
+        print("{:<20} {:>6} {:>7} {:>10} {:>10} {:>8}".format(
+            label, entry['frames'], entry['drifted'], mismatched, max_diff, speedup))
+    print("Map fidelity: reference {:.2f}% ({:.2f}% mapped), variants {:.2f}% ({:.2f}% mapped)"
+          .format(*reference_fidelity, *variant_fidelity))
+    print("Fidelity delta: {:+.3f}%".format(variant_fidelity[0] - reference_fidelity[0]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Golden output equivalence checks of the perception kernels')
+    parser.add_argument('command', choices=('record', 'check'),
+                        help='Record the reference outputs or check against them.')
+    parser.add_argument('--log', type=str, default=DEFAULT_LOG,
+                        help='robot_log.csv of the frames & poses to run on.')
+    parser.add_argument('--golden', type=str, default=DEFAULT_GOLDEN,
+                        help='File of the recorded reference outputs.')
+    parser.add_argument('--variant', type=str, action='append', default=[],
+                        help='Kernel to check as kernel=module:function, repeatable.')
+    parser.add_argument('--atol', type=float, default=0.0,
+                        help='Allowed absolute difference, 0 for exact equivalence.')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        count = record(args.log, args.golden)
+        print("Recorded the reference outputs of {} frames to {}".format(count, args.golden))
+    else:
+        variants = dict(load_variant(spec) for spec in args.variant)
+        stats, reference_fidelity, variant_fidelity = check(
+            args.log, args.golden, variants, args.atol)
+        print_report(stats, reference_fidelity, variant_fidelity, variants)
+        failed = any(entry['drifted'] or entry['mismatched'] for entry in stats.values())
+        raise SystemExit(1 if failed else 0)
@@ -0,0 +1,293 @@
+import argparse
+import ast
+import time
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+
+from decision import decision_step
+from perception import calibration_points, perception_step
+from rover_state import RoverState, load_ground_truth
+
+# Simulated camera image shape & top-down scale (pixels per meter)
+IMAGE_SHAPE = (160, 320, 3)
+PIXELS_PER_METER = 10
+# Texture pixels per worldmap cell (meter)
+TEXTURE_SCALE = 10
+
+# Colors of the synthesized terrain & rocks
+GROUND_COLOR = (200, 185, 165)
+OBSTACLE_COLOR = (90, 70, 50)
+ROCK_COLOR = (190, 160, 20)
+ROCK_RADIUS = 0.3  # meters
+
+# Start pose of the simulator recordings in test_dataset
+START_POS = (99.67, 85.59)
+
+# Rover dynamics
+TIME_STEP = 1 / 25  # Seconds per telemetry frame
+ACCELERATION = 2.0  # m/s^2 at full throttle
+BRAKE_DECELERATION = 4.0  # m/s^2 per unit of brake
+DRAG = 0.2  # 1/s
+WHEELBASE = 1.0  # meters
+TURN_RATE = 4.0  # Turn in place rate (deg/s) per degree of steering
+NEAR_SAMPLE_DIST = 1.0  # meters
+PICKUP_TIME = 2.0  # seconds
+
+
+# =====================================================
+# ---> Headless Simulator
+# =====================================================
+
+
+class HeadlessSim:
+    """Kinematic stand-in for the Unity simulator. The world is the ground
+    truth map, where rock samples are placed on navigable cells. Camera
+    images are synthesized by rendering the top-down view seen by
+    perception_step() and un-warping it with the perspective calibration."""
+
+    def __init__(self, n_samples=6, seed=None, start_pos=START_POS, start_yaw=None):
+        self.rng = np.random.default_rng(seed)
+        self.navigable = load_ground_truth()[0] > 0
+        self.world_size = self.navigable.shape[0]
+
+        # Rock samples on random navigable cells
+        nav_ys, nav_xs = self.navigable.nonzero()
+        picks = self.rng.choice(len(nav_xs), n_samples, replace=False)
+        self.samples = [(nav_xs[idx] + 0.5, nav_ys[idx] + 0.5) for idx in picks]
+        self.samples_start = list(self.samples)
+        self.build_texture()
+
+        # Rover pose & state as reported by the telemetry
+        self.pos = np.array(start_pos, dtype=float)
+        self.yaw = self.rng.uniform(0, 360) if start_yaw is None else start_yaw
+        self.pitch = 0.0
+        self.roll = 0.0
+        self.vel = 0.0
+        self.commands = (0, 0, 0)  # Last (throttle, brake, steer) received
+        self.time = 0.0
+        self.pickup_left = 0.0  # Time left picking up a sample
+
+        # Perspective un-warping & top-down view pixel offsets (meters)
+        source, destination = calibration_points(IMAGE_SHAPE)
+        self.transform_matrix = cv2.getPerspectiveTransform(source, destination)
+        rows, cols = np.indices(IMAGE_SHAPE[:2])
+        self.view_x = (IMAGE_SHAPE[0] - rows).astype(np.float32) / PIXELS_PER_METER
+        self.view_y = (IMAGE_SHAPE[1] / 2 - cols).astype(np.float32) / PIXELS_PER_METER
+
+    def build_texture(self):
+        """Renders the world at TEXTURE_SCALE pixels per meter."""
+        texture = np.where(self.navigable[:, :, None], GROUND_COLOR, OBSTACLE_COLOR)
+        texture = cv2.resize(texture.astype(np.uint8), None, fx=TEXTURE_SCALE,
+                             fy=TEXTURE_SCALE, interpolation=cv2.INTER_NEAREST)
+        for x, y in self.samples:
+            cv2.circle(texture, (int(x * TEXTURE_SCALE), int(y * TEXTURE_SCALE)),
+                       int(ROCK_RADIUS * TEXTURE_SCALE), ROCK_COLOR, -1)
+        self.texture = texture
+
+    def camera_image(self):
+        """Synthesizes the camera image seen from the current pose."""
+        yaw_rad = self.yaw * np.pi / 180
+        cos_yaw, sin_yaw = np.cos(yaw_rad), np.sin(yaw_rad)
+        world_x = self.pos[0] + self.view_x * cos_yaw - self.view_y * sin_yaw
+        world_y = self.pos[1] + self.view_x * sin_yaw + self.view_y * cos_yaw
+        # cv2.remap() needs float32 maps
+        map_x = (world_x * TEXTURE_SCALE).astype(np.float32)
+        map_y = (world_y * TEXTURE_SCALE).astype(np.float32)
+        warped = cv2.remap(self.texture, map_x, map_y, cv2.INTER_NEAREST,
+                           borderMode=cv2.BORDER_CONSTANT, borderValue=OBSTACLE_COLOR)
+        return cv2.warpPerspective(warped, self.transform_matrix,
+                                   (IMAGE_SHAPE[1], IMAGE_SHAPE[0]),
+                                   flags=cv2.WARP_INVERSE_MAP)
+
+    def closest_sample(self):
+        if not self.samples:
+            return None, np.inf
+        dists = [np.hypot(x - self.pos[0], y - self.pos[1]) for x, y in self.samples]
+        idx = int(np.argmin(dists))
+        return idx, dists[idx]
+
+    def near_sample(self):
+        return int(self.closest_sample()[1] < NEAR_SAMPLE_DIST)
+
+    def is_navigable(self, x, y):
+        col, row = int(x), int(y)
+        return 0 <= col < self.world_size and 0 <= row < self.world_size \
+            and self.navigable[row, col]
+
+    def step(self, commands=None, pickup=False):
+        """Advances the simulation by one telemetry frame. Like the Unity
+        simulator, the last commands are kept when only a pickup is sent."""
+        if commands is not None:
+            self.commands = commands
+        throttle, brake, steer = self.commands
+        self.time += TIME_STEP
+
+        if pickup and self.pickup_left <= 0 and self.near_sample() and self.vel == 0:
+            self.pickup_left = PICKUP_TIME
+        if self.pickup_left > 0:
+            # Frozen while picking up, the sample goes away at the end
+            self.pickup_left -= TIME_STEP
+            if self.pickup_left <= 0:
+                self.samples.pop(self.closest_sample()[0])
+                self.build_texture()
+            return
+
+        # Speed
+        accel = ACCELERATION * throttle - DRAG * self.vel
+        new_vel = self.vel + accel * TIME_STEP
+        braking = BRAKE_DECELERATION * brake * TIME_STEP
+        if abs(new_vel) <= braking:
+            new_vel = 0.0
+        else:
+            new_vel -= np.sign(new_vel) * braking
+        if abs(new_vel) < 0.01 and throttle == 0:
+            new_vel = 0.0
+
+        # Heading: skid steer in place when stopped, else bicycle model
+        if abs(new_vel) < 0.2 and throttle == 0 and brake == 0:
+            yaw_rate = TURN_RATE * steer
+        else:
+            yaw_rate = new_vel * np.tan(steer * np.pi / 180) / WHEELBASE * 180 / np.pi
+        self.yaw = (self.yaw + yaw_rate * TIME_STEP) % 360
+
+        # Position, stopped dead by obstacles
+        yaw_rad = self.yaw * np.pi / 180
+        new_pos = self.pos + new_vel * TIME_STEP * np.array([np.cos(yaw_rad), np.sin(yaw_rad)])
+        if self.is_navigable(*new_pos):
+            self.pos = new_pos
+        else:
+            new_vel = 0.0
+
+        # Body tilt from the acceleration & turning, in [0, 360) like the simulator
+        self.pitch = (-0.5 * (new_vel - self.vel) / TIME_STEP) % 360
+        self.roll = (0.1 * new_vel * yaw_rate * np.pi / 180) % 360
+        self.vel = new_vel
+
+    def update_rover(self, Rover):
+        """Fills the Rover with the telemetry, like update_rover() does."""
+        if Rover.start_time is None:
+            Rover.start_time = 0
+            Rover.samples_pos = ([x for x, _ in self.samples_start],
+                                 [y for _, y in self.samples_start])
+            Rover.samples_to_find = len(self.samples_start)
+        Rover.total_time = self.time
+        Rover.vel = self.vel
+        Rover.pos = [self.pos[0], self.pos[1]]
+        Rover.yaw = self.yaw
+        Rover.pitch = self.pitch
+        Rover.roll = self.roll
+        Rover.throttle, _, Rover.steer = self.commands
+        Rover.near_sample = self.near_sample()
+        Rover.picking_up = int(self.pickup_left > 0)
+        Rover.samples_collected = len(self.samples_start) - len(self.samples)
+        Rover.img = self.camera_image()
+
+
+# =====================================================
+# ---> Episodes
+# =====================================================
+
+
+def run_episode(seed, duration=600.0, settings=None, n_samples=6):
+    """Runs perception_step() + decision_step() in closed loop with the
+    headless simulator for duration simulated seconds. Returns the
+    mission statistics."""
+    sim = HeadlessSim(n_samples=n_samples, seed=seed)
+    Rover = RoverState()
+    Rover.fps = int(1 / TIME_STEP)
+    for name, value in (settings or {}).items():
+        setattr(Rover, name, value)
+
+    truth = load_ground_truth()[0] > 0
+    mode_frames = {}
+    wall_start = time.perf_counter()
+    while sim.time < duration:
+        sim.update_rover(Rover)
+        perception_step(Rover)
+        decision_step(Rover)
+        mode_frames[Rover.mode] = mode_frames.get(Rover.mode, 0) + 1
+
+        # Same as the telemetry handler: a pickup is sent instead of commands
+        if Rover.send_pickup and not Rover.picking_up:
+            sim.step(pickup=True)
+            Rover.send_pickup = False
+        else:
+            sim.step((Rover.throttle, Rover.brake, Rover.steer))
+
+        if 0 < Rover.samples_to_find <= Rover.samples_collected and \
+                Rover.mode == 'going_to_goal' and Rover.brake == Rover.brake_set \
+                and sim.vel == 0:
+            # Back home with all the samples
+            break
+
+    nav_pix = Rover.worldmap[:, :, 2] > 0
+    good_nav_pix = np.count_nonzero(nav_pix & truth)
+    return {
+        'seed': seed,
+        'time': sim.time,
+        'wall_time': time.perf_counter() - wall_start,
+        'mapped': 100 * good_nav_pix / np.count_nonzero(truth),
+        'fidelity': 100 * good_nav_pix / max(np.count_nonzero(nav_pix), 1),
+        'collected': Rover.samples_collected,
+        'seen': len(Rover.samples_seen),
+        'mode_frames': mode_frames,
+    }
+
+
+def _run_episode(job):
+    return run_episode(*job)
+
+
+def parse_settings(pairs):
+    """Parses name=value Rover overrides, values as Python literals."""
+    settings = {}
+    for pair in pairs:
+        name, value = pair.split('=', 1)
+        try:
+            settings[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            settings[name] = value
+    return settings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless Rover simulation')
+    parser.add_argument('--episodes', type=int, default=8,
+                        help='Number of episodes to run.')
+    parser.add_argument('--duration', type=float, default=600.0,
+                        help='Simulated seconds per episode.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Parallel processes, defaults to the number of cores.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the first episode.')
+    parser.add_argument('--samples', type=int, default=6,
+                        help='Rock samples placed per episode.')
+    parser.add_argument('--set', dest='settings', nargs='*', default=[],
+                        metavar='NAME=VALUE',
+                        help='Override Rover fields, e.g. --set stop_forward=300 roi_only=True')
+    args = parser.parse_args()
+
+    settings = parse_settings(args.settings)
+    jobs = [(args.seed + idx, args.duration, settings, args.samples)
+            for idx in range(args.episodes)]
+
+    start = time.perf_counter()
+    with Pool(args.workers) as pool:
+        results = []
+        for result in pool.imap_unordered(_run_episode, jobs):
+            results.append(result)
+            print("seed {seed}: {time:.0f} s in {wall_time:.1f} s, mapped {mapped:.1f}%, "
+                  "fidelity {fidelity:.1f}%, collected {collected}/{seen} seen"
+                  .format(**result))
+    elapsed = time.perf_counter() - start
+
+    sim_time = sum(result['time'] for result in results)
+    print("{} episodes, {:.0f}x real time".format(len(results), sim_time / elapsed))
+    for key in ('mapped', 'fidelity', 'collected'):
+        values = [result[key] for result in results]
+        print("{}: mean {:.2f}, min {:.2f}, max {:.2f}".format(
+            key, np.mean(values), np.min(values), np.max(values)))
+    reverse_frames = [result['mode_frames'].get('reverse', 0) for result in results]
+    print("time in reverse: mean {:.1f} s".format(np.mean(reverse_frames) * TIME_STEP))
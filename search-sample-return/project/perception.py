@@ -1,12 +1,49 @@
 import cv2
 import numpy as np
 
+# Region of the warped image kept by the mask in perspective_transform()
+# (rows, cols). Everything outside of it is discarded.
+ROI_ROWS = (35, 160)
+ROI_COLS = (80, 240)
+
+# Cached ROI transform matrices & masks, keyed on the calibration points
+_roi_transforms = {}
+
+# Angular bins (degrees) of the navigable terrain histogram
+NAV_HIST_BINS = 180
+NAV_HIST_EDGES = np.linspace(-90, 90, NAV_HIST_BINS + 1)
+NAV_HIST_CENTERS = (NAV_HIST_EDGES[:-1] + NAV_HIST_EDGES[1:]) / 2
+
+# Cached per pixel bin index & distance, keyed on the label image shape
+_nav_hist_luts = {}
+
 
 # ================================
 #      Perspective Transform
 # ================================
 
 
+def calibration_points(image_shape, dst_size=5, bottom_offset=6):
+    """Returns the source (camera) and destination (top-down) points of
+    the perspective transform, for camera images of the given shape."""
+
+    # The source (actual) and destination (desired) points are defined to warp
+    # the input image to a grid where each 10x10 pixel square represents 1 square meter
+    # The destination box will be 2*dst_size on each side
+    # The bottom offset is required because the rover's POV angle
+    # Reaches the ground in front of the Rover.
+    source = np.float32([[14, 140], [301, 140], [200, 96], [118, 96]])
+    destination = np.float32([[image_shape[1] / 2 - dst_size,
+                               image_shape[0] - bottom_offset],
+                              [image_shape[1] / 2 + dst_size,
+                               image_shape[0] - bottom_offset],
+                              [image_shape[1] / 2 + dst_size,
+                               image_shape[0] - 2 * dst_size - bottom_offset],
+                              [image_shape[1] / 2 - dst_size,
+                               image_shape[0] - 2 * dst_size - bottom_offset]])
+    return source, destination
+
+
 def perspective_transform(img, src, dst):
     """Performs a perspective transform.
     Used to convert the Rover camera's POV to a "top-down" world view."""
@@ -25,10 +62,34 @@ def perspective_transform(img, src, dst):
                                dsize=(img.shape[1], img.shape[0]),
                                borderMode=cv2.BORDER_CONSTANT, borderValue=0)
     # Cropped the mask to narrow the Rover's POV. Improves Rover's navigation.
-    mask = mask[35:160, 80:240]
+    mask = mask[ROI_ROWS[0]:ROI_ROWS[1], ROI_COLS[0]:ROI_COLS[1]]
     # Adding a black border to cropped mask to regain original shape of (160, 320)
     mask = cv2.copyMakeBorder(
-        mask, 35, 0, 80, 80, cv2.BORDER_CONSTANT, value=(0, 0, 0))
+        mask, ROI_ROWS[0], img.shape[0] - ROI_ROWS[1],
+        ROI_COLS[0], img.shape[1] - ROI_COLS[1],
+        cv2.BORDER_CONSTANT, value=(0, 0, 0))
+    return warped, mask
+
+
+def perspective_transform_roi(img, src, dst):
+    """Same as perspective_transform() but only warps the ROI kept by its mask.
+    The returned view is bottom-center aligned with the full warped image,
+    so rover_coords() gives the same coordinates for both."""
+
+    key = (src.tobytes(), dst.tobytes(), img.shape[:2])
+    if key not in _roi_transforms:
+        # Shift the destination points so the ROI starts at (0, 0)
+        shift = np.float32([ROI_COLS[0], ROI_ROWS[0]])
+        transform_matrix = cv2.getPerspectiveTransform(src, dst - shift)
+        size = (ROI_COLS[1] - ROI_COLS[0], ROI_ROWS[1] - ROI_ROWS[0])
+        # The mask only depends on the calibration, so it is computed once
+        mask = cv2.warpPerspective(src=np.ones(img.shape[:2], dtype=img.dtype),
+                                   M=transform_matrix, dsize=size,
+                                   borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        _roi_transforms[key] = (transform_matrix, size, mask)
+
+    transform_matrix, size, mask = _roi_transforms[key]
+    warped = cv2.warpPerspective(img, transform_matrix, size)
     return warped, mask
 
 
@@ -154,6 +215,161 @@ def find_rocks(img, levels=(110, 110, 50)):
     return color_select
 
 
+def find_rock_blobs(rock_map, min_area=1):
+    """Collapses the rock pixels returned from find_rocks() into blobs
+    using connected components. Returns the rover-centric [x, y] coords
+    of each blob's centroid and its area in pixels."""
+
+    _, _, stats, centroids = cv2.connectedComponentsWithStats(
+        rock_map.astype(np.uint8), connectivity=8)
+
+    # Label 0 is the background
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    keep = areas >= min_area
+    x_centroid, y_centroid = centroids[1:][keep].T
+
+    # Same reference as rover_coords(): the Rover is at the center bottom
+    x_pixel = rock_map.shape[0] - y_centroid
+    y_pixel = rock_map.shape[1] / 2 - x_centroid
+
+    return x_pixel, y_pixel, areas[keep]
+
+
+# ================================
+#      Navigable Terrain Histogram
+# ================================
+
+
+def nav_hist_lut(shape):
+    """Returns the angle bin and distance of every pixel of a label image
+    of the given shape. Both only depend on the pixel position, so they
+    are computed once per shape."""
+
+    if shape not in _nav_hist_luts:
+        ypos, xpos = np.indices(shape)
+        x_pixel = -(ypos - shape[0]).astype(float)
+        y_pixel = -(xpos - shape[1] / 2).astype(float)
+        dist, angles = to_polar_coords(x_pixel, y_pixel)
+        bins = np.digitize(angles * 180 / np.pi, NAV_HIST_EDGES) - 1
+        bins = np.clip(bins, 0, NAV_HIST_BINS - 1)
+        _nav_hist_luts[shape] = (bins, dist)
+    return _nav_hist_luts[shape]
+
+
+def nav_histogram(binary_img):
+    """Builds the angular histogram of the navigable pixels in the binary
+    image returned from color_thresh(). Returns the pixel count and the
+    mean distance (in pixels) of each bin of NAV_HIST_CENTERS."""
+
+    bins, dist = nav_hist_lut(binary_img.shape)
+    nav_pix = binary_img > 0
+    nav_bins = bins[nav_pix]
+
+    counts = np.bincount(nav_bins, minlength=NAV_HIST_BINS)
+    dist_sums = np.bincount(nav_bins, weights=dist[nav_pix],
+                            minlength=NAV_HIST_BINS)
+    mean_dists = np.zeros(NAV_HIST_BINS)
+    np.divide(dist_sums, counts, out=mean_dists, where=counts > 0)
+
+    return counts, mean_dists
+
+
+# ============================
+#      Worldmap Update
+# ============================
+
+
+def update_worldmap(worldmap, nav, obs):
+    """Accumulates the navigable & obstacle cells (ys, xs) of one frame
+    into the worldmap. Returns the touched cells (ys, xs)."""
+    nav_ys, nav_xs = nav
+    obs_ys, obs_xs = obs
+
+    # World Map's Navigable Pixels
+    worldmap[nav_ys, nav_xs, 2] += 255
+    # Clear opposing data to improve Fidelity
+    worldmap[obs_ys, obs_xs, 2] -= 40
+
+    # World Map's Obstacles
+    worldmap[obs_ys, obs_xs, 0] += 255
+    # Clear opposing data to improve Fidelity
+    worldmap[nav_ys, nav_xs, 0] -= 90
+
+    return np.concatenate((nav_ys, obs_ys)), np.concatenate((nav_xs, obs_xs))
+
+
+# ============================
+#      Map Update Gate
+# ============================
+
+
+def tilt(angle):
+    """Absolute deviation (degrees) from level of a pitch or roll angle
+    reported in the range 0 to 360."""
+    angle = angle % 360
+    return min(angle, 360 - angle)
+
+
+def map_pose_valid(Rover):
+    """The perspective transform assumes a level camera over flat ground,
+    frames taken while pitched or rolled (braking, accelerating, turning,
+    climbing rocks) project to wrong world cells."""
+    return tilt(Rover.pitch) <= Rover.map_max_pitch \
+        and tilt(Rover.roll) <= Rover.map_max_roll
+
+
+def map_update_due(Rover, threshed):
+    """Decides if the current frame should be projected into the worldmap,
+    counting the accepted & rejected frames.
+    Frames with an invalid pose (see map_pose_valid()) are never mapped."""
+
+    if not map_pose_valid(Rover):
+        Rover.map_rejected_pose += 1
+        return False
+    if map_frame_novel(Rover, threshed):
+        Rover.map_accepted += 1
+        return True
+    Rover.map_rejected_stale += 1
+    return False
+
+
+def map_frame_novel(Rover, threshed):
+    """Frames taken from (nearly) the same pose that look (nearly) the same as
+    the last mapped frame add nothing new, e.g. while stopped or picking up
+    a rock. Only every Rover.map_decimation-th of those is mapped."""
+
+    if not Rover.map_gate or Rover.last_map_pose is None:
+        return True
+    if Rover.frames_since_map >= Rover.map_decimation:
+        return True
+
+    # Pose delta since the last mapped frame
+    last_x, last_y, last_yaw = Rover.last_map_pose
+    moved = np.hypot(Rover.pos[0] - last_x, Rover.pos[1] - last_y)
+    turned = abs((Rover.yaw - last_yaw + 180) % 360 - 180)
+    if moved > Rover.map_gate_dist or turned > Rover.map_gate_yaw:
+        return True
+
+    # Cheap frame difference on the navigable terrain labels
+    last_labels = Rover.last_map_labels
+    if last_labels is None or last_labels.shape != threshed.shape:
+        return True
+    changed = np.count_nonzero(threshed != last_labels) / threshed.size
+    return changed > Rover.map_gate_diff
+
+
+def rocks_to_chase(Rover, rock_x, rock_y):
+    """True for the detected rocks (world coordinates) the Rover may drive
+    to, False for those near a rock given up on (see rock_stuck() in
+    decision.py) until its time is over."""
+    Rover.rocks_given_up = [rock for rock in Rover.rocks_given_up
+                            if Rover.total_time < rock[2]]
+    chase = np.ones(len(rock_x), dtype=bool)
+    for x, y, _ in Rover.rocks_given_up:
+        chase &= np.hypot(rock_x - x, rock_y - y) >= 3
+    return chase
+
+
 # ===========================
 #      Rover Perception
 # ===========================
@@ -167,33 +383,23 @@ def perception_step(Rover):
     # 1) Define source and destination points for perspective transform
     # ==================================================================
 
-    # The bottom offset is required because the rover's POV angle
-    # Reaches the ground in front of the Rover.
-    bottom_offset = 6
-
     # The destination box will be 2*dst_size on each side
     dst_size = 5
 
     # Camera image is received by Rover.img
-    image = Rover.img
-
-    # The source (actual) and destination (desired) points are defined to warp
-    # the input image to a grid where each 10x10 pixel square represents 1 square meter
-    source = np.float32([[14, 140], [301, 140], [200, 96], [118, 96]])
-    destination = np.float32([[image.shape[1] / 2 - dst_size,
-                               image.shape[0] - bottom_offset],
-                              [image.shape[1] / 2 + dst_size,
-                               image.shape[0] - bottom_offset],
-                              [image.shape[1] / 2 + dst_size,
-                               image.shape[0] - 2 * dst_size - bottom_offset],
-                              [image.shape[1] / 2 - dst_size,
-                               image.shape[0] - 2 * dst_size - bottom_offset]])
+    source, destination = calibration_points(Rover.img.shape, dst_size)
 
     # =================================
     # 2) Apply perspective transform
     # =================================
 
-    warped, mask = perspective_transform(Rover.img, source, destination)
+    if Rover.roi_only:
+        # Only warp the ROI, rocks outside of it are not detected
+        warped, mask = perspective_transform_roi(Rover.img, source, destination)
+        view = (slice(*ROI_ROWS), slice(*ROI_COLS))
+    else:
+        warped, mask = perspective_transform(Rover.img, source, destination)
+        view = (slice(None), slice(None))
 
     # =============================================================================
     # 3) Apply color threshold to identify navigable terrain/obstacles/rock samples
@@ -210,78 +416,131 @@ def perception_step(Rover):
 
     # Multiplying by 255 because threshed & obs_map are only 1's & 0's
     # World Map's Red Channel
-    Rover.vision_image[:, :, 0] = obs_map * 255
+    Rover.vision_image[view + (0,)] = obs_map * 255
     # World Map's Blue Channel
-    Rover.vision_image[:, :, 2] = threshed * 255
+    Rover.vision_image[view + (2,)] = threshed * 255
 
     # ==========================================================
     # 5) Convert map image pixel values to rover-centric coords
     # ==========================================================
 
-    xpix, ypix = rover_coords(threshed)
-    xpix_obs, ypix_obs = rover_coords(obs_map)
-
-    # ===========================================================
-    # 6) Convert rover-centric pixel values to world coordinates
-    # ===========================================================
-
     world_size = Rover.worldmap.shape[0]
     scale = 2 * dst_size
 
-    # Rover ---> World Pixels
-    x_world, y_world = pix_to_world(xpix, ypix, Rover.pos[0], Rover.pos[1],
-                                    Rover.yaw, world_size, scale)
-    # Obstacles ---> World Pixels
-    obs_x_world, obs_y_world = pix_to_world(xpix_obs, ypix_obs, Rover.pos[0],
-                                            Rover.pos[1], Rover.yaw,
-                                            world_size, scale)
-
-    # ==================================================================
-    # 7) Update Rover worldmap (to be displayed on right side of screen)
-    # ==================================================================
-
-    # World Map's Navigable Pixels
-    Rover.worldmap[y_world, x_world, 2] += 255
-    # Clear opposing data to improve Fidelity
-    Rover.worldmap[obs_y_world, obs_x_world, 2] -= 40
-
-    # World Map's Obstacles
-    Rover.worldmap[obs_y_world, obs_x_world, 0] += 255
-    # Clear opposing data to improve Fidelity
-    Rover.worldmap[y_world, x_world, 0] -= 90
+    # Skip the world projection of frames taken while tilted
+    # or that add nothing new to the map
+    update_map = map_update_due(Rover, threshed)
+
+    if update_map:
+        Rover.last_map_pose = (Rover.pos[0], Rover.pos[1], Rover.yaw)
+        Rover.last_map_labels = threshed
+        Rover.frames_since_map = 0
+
+        xpix, ypix = rover_coords(threshed)
+        xpix_obs, ypix_obs = rover_coords(obs_map)
+
+        # ===========================================================
+        # 6) Convert rover-centric pixel values to world coordinates
+        # ===========================================================
+
+        # Rover ---> World Pixels
+        x_world, y_world = pix_to_world(xpix, ypix, Rover.pos[0], Rover.pos[1],
+                                        Rover.yaw, world_size, scale)
+        # Obstacles ---> World Pixels
+        obs_x_world, obs_y_world = pix_to_world(xpix_obs, ypix_obs, Rover.pos[0],
+                                                Rover.pos[1], Rover.yaw,
+                                                world_size, scale)
+
+        # ==================================================================
+        # 7) Update Rover worldmap (to be displayed on right side of screen)
+        # ==================================================================
+
+        # Cells touched by this frame, used to update the map indexes
+        Rover.map_touched = update_worldmap(Rover.worldmap, (y_world, x_world),
+                                            (obs_y_world, obs_x_world))
+        Rover.frontier.update(Rover.worldmap, *Rover.map_touched)
+        Rover.clearance.update(Rover.worldmap, *Rover.map_touched)
+        if Rover.planner is not None:
+            Rover.planner.update_cells(Rover.worldmap, *Rover.map_touched)
+    else:
+        Rover.frames_since_map += 1
+        Rover.map_touched = None
 
     # ==============================================================
     # 8) Convert rover-centric pixel positions to polar coordinates
     # ==============================================================
 
-    # Update Rover pixel distances and angles
-    dist, angles = to_polar_coords(xpix, ypix)
+    # Angular histogram of the navigable terrain used for steering
+    nav_counts, nav_dists = nav_histogram(threshed)
 
-    # Find Rover Coordinates
-    rock_x, rock_y = rover_coords(rock_map)
+    # ========================================================
+    # 9) Detect rock samples & track them in world coordinates
+    # ========================================================
 
-    # Find the closest Rock to Rover
+    # Collapse rock pixels into blobs, only their centroids are projected
+    rock_x, rock_y, rock_areas = find_rock_blobs(rock_map)
     rock_dist, rock_angles = to_polar_coords(rock_x, rock_y)
 
-    if rock_map.any():
+    # Track the rocks with unclipped (float) world coordinates. Like the
+    # terrain, rocks seen while tilted project to wrong world positions,
+    # so only their rover-centric angle & distance are used then
+    rock_pose_valid = map_pose_valid(Rover)
+    rock_x_rot, rock_y_rot = rotate_pix(rock_x, rock_y, Rover.yaw)
+    rock_x_track, rock_y_track = translate_pix(rock_x_rot, rock_y_rot, Rover.pos[0],
+                                               Rover.pos[1], scale)
+    if rock_pose_valid:
+        Rover.rock_tracker.update(rock_x_track, rock_y_track, rock_areas)
+
+    Rover.vision_image[view + (1,)] = rock_map * 225
+    if len(rock_areas) > 0 and rock_pose_valid:
         # At Rock to World Map
         rock_x_world, rock_y_world = pix_to_world(
             rock_x, rock_y, Rover.pos[0], Rover.pos[1], Rover.yaw, world_size, scale)
         Rover.worldmap[rock_y_world, rock_x_world, 1] += 255
-        Rover.vision_image[:, :, 1] = rock_map * 225
+        Rover.rocks_touched = (rock_y_world, rock_x_world)
+
+        # Remember which of the known samples were detected
+        if Rover.samples_pos is not None:
+            samples_x, samples_y = (np.asarray(pos)[:, None] for pos in Rover.samples_pos)
+            sample_dists = np.hypot(samples_x - rock_x_track, samples_y - rock_y_track)
+            Rover.samples_seen.update(
+                np.flatnonzero(sample_dists.min(axis=1) < 3).tolist())
 
     else:
-        Rover.vision_image[:, :, 1] = 0
+        Rover.rocks_touched = None
 
-    if len(rock_dist) > 0:
+    chase = rocks_to_chase(Rover, rock_x_track, rock_y_track)
+    if chase.any():
         if Rover.mode == 'reverse':
             Rover.mode = 'reverse'
         else:
+            # Head for the closest Rock
+            closest = np.argmin(np.where(chase, rock_dist, np.inf))
+            if rock_pose_valid:
+                target = Rover.rock_tracker.closest(rock_x_track[closest],
+                                                    rock_y_track[closest])
+                Rover.rock_target = target['id']
             Rover.mode = 'going_to_rock'
-            Rover.rock_dists = rock_dist
-            Rover.rock_angle = rock_angles
+            Rover.rock_dists = rock_dist[closest]
+            Rover.rock_angle = rock_angles[closest]
     else:
-        Rover.nav_dists = dist
-        Rover.nav_angles = angles
+        Rover.nav_hist_counts = nav_counts
+        Rover.nav_hist_dists = nav_dists
+        Rover.nav_count = int(nav_counts.sum())
+
+        if Rover.mode == 'going_to_rock':
+            # Keep heading for a Rock that is briefly out of view,
+            # e.g. once it is too close to be seen by the camera
+            target = Rover.rock_tracker.get(Rover.rock_target)
+            if target is not None:
+                delta_x = target['pos'][0] - Rover.pos[0]
+                delta_y = target['pos'][1] - Rover.pos[1]
+                bearing = np.arctan2(delta_y, delta_x) - Rover.yaw * np.pi / 180
+                Rover.rock_dists = np.hypot(delta_x, delta_y) * scale
+                Rover.rock_angle = np.arctan2(np.sin(bearing), np.cos(bearing))
+            else:
+                # Rock lost for good
+                Rover.rock_target = None
+                Rover.mode = 'forward'
 
     return Rover
@@ -0,0 +1,238 @@
+import heapq
+import time
+
+import numpy as np
+
+from frontier import NEIGHBOURS_8, known_cells, navigable_cells
+from tiled_map import map_blocks
+
+# Offsets & step costs of the 8 neighbours of a cell
+MOVES = [(dy, dx, np.hypot(dy, dx)) for dy, dx in NEIGHBOURS_8.tolist()
+         if (dy, dx) != (0, 0)]
+
+# Keys are rounded to this many decimals: g + heuristic sums of the same
+# path cost differ in the last bits depending on the summation order, and
+# the heap must see them as ties for the k2 tie-break to apply
+KEY_DECIMALS = 9
+KEY_EPS = 10.0 ** -KEY_DECIMALS
+
+
+def key_less(a, b):
+    """Lexicographic a < b of two (k1, k2) keys, up to KEY_EPS."""
+    if abs(a[0] - b[0]) > KEY_EPS:
+        return a[0] < b[0]
+    return a[1] < b[1] - KEY_EPS
+
+
+# =====================================================
+# ---> Occupancy
+# =====================================================
+
+
+def blocked_cells(worldmap, ys, xs):
+    """True for the cells mapped as obstacles. Unknown cells are
+    considered free so the planner is optimistic about unexplored terrain."""
+    return known_cells(worldmap, ys, xs) & ~navigable_cells(worldmap, ys, xs)
+
+
+# =====================================================
+# ---> D* Lite
+# =====================================================
+
+
+class DStarLite:
+    """D* Lite path planner over the worldmap grid (1 cell = 1 meter).
+    Plans from the goal back to the Rover, so when the Rover moves or
+    cells of the map change, only the affected part of the plan is
+    repaired instead of replanning from scratch.
+    Cells are (x, y) tuples of ints."""
+
+    def __init__(self, worldmap, start, goal):
+        self.world_size = worldmap.shape[0]
+        # Blocked cells, only the explored part of the map is scanned
+        self.blocked = set()
+        for y0, x0, block in map_blocks(worldmap):
+            ys, xs = np.indices(block.shape[:2])
+            ys, xs = ys.ravel(), xs.ravel()
+            blocked = blocked_cells(block, ys, xs)
+            self.blocked.update(zip((xs[blocked] + x0).tolist(),
+                                    (ys[blocked] + y0).tolist()))
+
+        # Cost-to-goal estimates, missing cells are infinite
+        self.g = {}
+        self.rhs = {goal: 0.0}
+        self.start = start
+        self.last_start = start
+        self.goal = goal
+        self.km = 0.0  # Key modifier, grows as the Rover moves
+        self.queue = []  # Heap of (key, cell), may hold stale entries
+        self.queued = {}  # Current key of each queued cell
+
+        self.push(goal)
+
+    def heuristic(self, a, b):
+        """Octile distance between two cells."""
+        dx, dy = abs(a[0] - b[0]), abs(a[1] - b[1])
+        return max(dx, dy) + (np.sqrt(2) - 1) * min(dx, dy)
+
+    def key(self, cell):
+        best = min(self.g.get(cell, np.inf), self.rhs.get(cell, np.inf))
+        k1 = best + self.heuristic(self.start, cell) + self.km
+        return round(k1, KEY_DECIMALS), round(best, KEY_DECIMALS)
+
+    def push(self, cell):
+        key = self.key(cell)
+        self.queued[cell] = key
+        heapq.heappush(self.queue, (key, cell))
+
+    def neighbours(self, cell):
+        """Yields the neighbours of a cell with the cost to move there."""
+        x, y = cell
+        size = self.world_size
+        for dy, dx, step in MOVES:
+            nb_x, nb_y = x + dx, y + dy
+            if 0 <= nb_x < size and 0 <= nb_y < size:
+                # Moving into an obstacle is not possible, but the goal
+                # (e.g. a rock) is always reachable
+                if (nb_x, nb_y) in self.blocked and (nb_x, nb_y) != self.goal:
+                    yield (nb_x, nb_y), np.inf
+                else:
+                    yield (nb_x, nb_y), step
+
+    def update_vertex(self, cell):
+        if cell != self.goal:
+            self.rhs[cell] = min((cost + self.g.get(nb, np.inf)
+                                  for nb, cost in self.neighbours(cell)),
+                                 default=np.inf)
+        self.queued.pop(cell, None)
+        if self.g.get(cell, np.inf) != self.rhs[cell]:
+            self.push(cell)
+
+    def compute(self, max_time=np.inf):
+        """Expands cells until the plan from the start is consistent or
+        max_time (seconds) runs out. Returns True once consistent."""
+        deadline = time.perf_counter() + max_time
+        expanded = 0
+        while self.queue:
+            key, cell = self.queue[0]
+            if self.queued.get(cell) != key:
+                # Stale entry
+                heapq.heappop(self.queue)
+                continue
+            if not key_less(key, self.key(self.start)) and \
+                    self.rhs.get(self.start, np.inf) <= self.g.get(self.start, np.inf):
+                return True
+
+            expanded += 1
+            if expanded % 64 == 0 and time.perf_counter() > deadline:
+                return False
+
+            heapq.heappop(self.queue)
+            del self.queued[cell]
+            new_key = self.key(cell)
+            if key_less(key, new_key):
+                self.push(cell)
+            elif self.g.get(cell, np.inf) > self.rhs.get(cell, np.inf):
+                self.g[cell] = self.rhs[cell]
+                for nb, _ in self.neighbours(cell):
+                    self.update_vertex(nb)
+            else:
+                self.g[cell] = np.inf
+                self.update_vertex(cell)
+                for nb, _ in self.neighbours(cell):
+                    self.update_vertex(nb)
+        return True
+
+    def move_start(self, start):
+        """Sets the Rover's current cell as the start of the plan."""
+        self.start = start
+
+    def update_cells(self, worldmap, ys, xs):
+        """Repairs the plan around the map cells (ys, xs) whose
+        occupancy changed."""
+        now_blocked = blocked_cells(worldmap, ys, xs)
+        cells = set(zip(xs.tolist(), ys.tolist(), now_blocked.tolist()))
+        changed = {(x, y) for x, y, blocked in cells
+                   if blocked != ((x, y) in self.blocked)}
+        if not changed:
+            return
+
+        # Account for the Rover's move since the last repair
+        self.km += self.heuristic(self.last_start, self.start)
+        self.last_start = self.start
+
+        for cell in changed:
+            self.blocked.symmetric_difference_update((cell,))
+        for cell in changed:
+            self.update_vertex(cell)
+            for nb, _ in self.neighbours(cell):
+                self.update_vertex(nb)
+
+    def waypoint(self, lookahead=5):
+        """Follows the plan lookahead cells from the start.
+        Returns the (x, y) cell reached, or None if there is no path."""
+        # compute() stops as soon as the start is locally consistent,
+        # which may leave g(start) unset: its cost is rhs(start)
+        if not np.isfinite(self.rhs.get(self.start, np.inf)):
+            return None
+        cell = self.start
+        for _ in range(lookahead):
+            if cell == self.goal:
+                break
+            cell, cost = min(((nb, step + self.g.get(nb, np.inf))
+                              for nb, step in self.neighbours(cell)),
+                             key=lambda move: move[1])
+            if not np.isfinite(cost):
+                return None
+        return cell
+
+
+if __name__ == '__main__':
+    # Self check: plan across an empty map, then around a wall
+    worldmap = np.zeros((200, 200, 3))
+    planner = DStarLite(worldmap, (20, 20), (25, 22))
+    assert planner.compute()
+    assert planner.waypoint(lookahead=10) == (25, 22), planner.waypoint(lookahead=10)
+
+    wall_ys = np.arange(10, 31)
+    wall_xs = np.full(len(wall_ys), 22)
+    worldmap[wall_ys, wall_xs, 0] = 255
+    planner.update_cells(worldmap, wall_ys, wall_xs)
+    assert planner.compute()
+    cell, steps = planner.start, 0
+    while cell != planner.goal:
+        planner.move_start(cell)
+        cell = planner.waypoint(lookahead=1)
+        assert cell is not None and cell not in planner.blocked
+        steps += 1
+    assert steps > 5, steps
+
+    # The repaired plan matches a plan from scratch after random obstacles
+    for seed in range(10):
+        rng = np.random.default_rng(seed)
+        worldmap = np.zeros((60, 60, 3))
+        start, goal = (5, 5), (50, 50)
+        planner = DStarLite(worldmap, start, goal)
+        planner.compute()
+        for _ in range(5):
+            ys, xs = rng.integers(0, 60, 40), rng.integers(0, 60, 40)
+            free = [(x, y) not in (start, goal) for x, y in zip(xs, ys)]
+            ys, xs = ys[free], xs[free]
+            worldmap[ys, xs, 0] = 255
+            planner.update_cells(worldmap, ys, xs)
+            assert planner.compute()
+        fresh = DStarLite(worldmap, start, goal)
+        fresh.compute()
+        cost = planner.rhs.get(start, np.inf)
+        assert np.isclose(cost, fresh.rhs.get(start, np.inf)), (seed, cost)
+
+        # Following the repaired plan costs what it promised
+        cell, travelled = start, 0.0
+        while cell != goal and np.isfinite(cost):
+            planner.move_start(cell)
+            planner.compute()
+            next_cell = planner.waypoint(lookahead=1)
+            travelled += np.hypot(next_cell[0] - cell[0], next_cell[1] - cell[1])
+            cell = next_cell
+        assert np.isclose(travelled, cost) or not np.isfinite(cost), (seed, travelled, cost)
+    print("DStarLite self check passed")
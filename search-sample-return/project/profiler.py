@@ -0,0 +1,179 @@
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+# Sections of the telemetry handler tracked for allocations
+ALLOC_SECTIONS = ('perception_step', 'decision_step', 'create_output_images')
+
+
+def collapse_stack(frame):
+    """Returns the stack of frame in the collapsed format of flamegraph.pl
+    (root first, 'file:function' entries separated by ';')."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+# =====================================================
+# ---> Runtime Profiler
+# =====================================================
+
+
+class Profiler:
+    """Profiling of the running server, switched on at runtime.
+
+    Stack sampling: a background thread samples the stack of the main
+    thread (where the telemetry handler runs) every interval seconds for
+    a window and writes the counts as a collapsed stack file, ready for
+    flamegraph.pl or speedscope.
+
+    Allocation tracking: while enabled, the tracemalloc top allocators
+    of each section of every frame are appended to a tab separated file.
+    tracemalloc is only started & stopped on the main thread, in tick()."""
+
+    def __init__(self, directory, interval=0.005, top=10):
+        self.directory = directory
+        self.interval = interval  # Seconds between stack samples
+        self.top = top  # Allocators recorded per section
+        self.target = threading.main_thread().ident
+        self.until = 0  # End time of the sampling window
+        self.wake = threading.Event()  # Set to start a sampling window
+        self.alloc_requested = False  # Allocation tracking requested
+        self.alloc_file = None  # Open while allocations are tracked
+        self.frame = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self.thread = threading.Thread(target=self.sampler, daemon=True)
+        self.thread.start()
+
+    @property
+    def sampling(self):
+        return time.time() < self.until
+
+    def start(self, seconds=10.0):
+        """Samples the stacks for the next seconds."""
+        self.until = time.time() + seconds
+        self.wake.set()
+
+    def toggle_allocations(self, enable=None):
+        """Requests allocation tracking on/off, applied on the next frame."""
+        self.alloc_requested = not self.alloc_requested if enable is None else enable
+
+    def status(self):
+        return 'sampling={} allocations={} frame={}'.format(
+            self.sampling, self.alloc_file is not None, self.frame)
+
+    # ---> Stack sampling
+
+    def sampler(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            stacks = Counter()
+            while self.sampling:
+                frame = sys._current_frames().get(self.target)
+                if frame is not None:
+                    stacks[collapse_stack(frame)] += 1
+                del frame
+                time.sleep(self.interval)
+            self.write_stacks(stacks)
+
+    def write_stacks(self, stacks):
+        path = os.path.join(self.directory, 'stacks_{}.folded'.format(
+            time.strftime('%Y_%m_%d_%H_%M_%S')))
+        try:
+            with open(path, 'w') as stack_file:
+                for stack, count in stacks.most_common():
+                    stack_file.write('{} {}\n'.format(stack, count))
+            print("Profiler wrote {} samples to {}".format(sum(stacks.values()), path))
+        except OSError as error:
+            print("Profiler failed: {}".format(error))
+
+    # ---> Allocation tracking
+
+    def tick(self):
+        """Called once per frame on the main thread."""
+        self.frame += 1
+        tracking = self.alloc_file is not None
+        if self.alloc_requested and not tracking:
+            path = os.path.join(self.directory, 'allocations_{}.tsv'.format(
+                time.strftime('%Y_%m_%d_%H_%M_%S')))
+            self.alloc_file = open(path, 'w')
+            self.alloc_file.write('frame\tsection\tsize_diff\tcount_diff\tlocation\n')
+            tracemalloc.start()
+        elif tracking and not self.alloc_requested:
+            tracemalloc.stop()
+            self.alloc_file.close()
+            self.alloc_file = None
+
+    @contextmanager
+    def section(self, name):
+        """Records the top allocators of the enclosed code, if tracking."""
+        if self.alloc_file is None:
+            yield
+            return
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__),)
+        before = tracemalloc.take_snapshot().filter_traces(ignore)
+        yield
+        after = tracemalloc.take_snapshot().filter_traces(ignore)
+        for stat in after.compare_to(before, 'lineno')[:self.top]:
+            self.alloc_file.write('{}\t{}\t{}\t{}\t{}\n'.format(
+                self.frame, name, stat.size_diff, stat.count_diff, stat.traceback[0]))
+
+    # ---> Triggers
+
+    def install_signals(self, window=10.0):
+        """SIGUSR1 samples the stacks for window seconds, SIGUSR2
+        toggles allocation tracking. Not available on Windows."""
+        if not hasattr(signal, 'SIGUSR1'):
+            return False
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.start(window))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self.toggle_allocations())
+        return True
+
+    def serve(self, port, window=10.0):
+        """Listens on localhost:port for line commands:
+        'profile [seconds]', 'alloc on|off' and 'status'."""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(('127.0.0.1', port))
+        server.listen(1)
+        thread = threading.Thread(target=self.control, args=(server, window), daemon=True)
+        thread.start()
+
+    def control(self, server, window):
+        while True:
+            connection, _ = server.accept()
+            try:
+                with connection, connection.makefile('rw') as stream:
+                    for line in stream:
+                        if line.strip():
+                            stream.write(self.command(line.split(), window) + '\n')
+                            stream.flush()
+            except (OSError, ValueError) as error:
+                # Client gone or sent undecodable bytes, keep serving
+                print("Profiler control connection closed: {}".format(error))
+
+    def command(self, words, window):
+        """Runs one control command, returns the reply line."""
+        try:
+            if words[0] == 'profile':
+                self.start(float(words[1]) if len(words) > 1 else window)
+            elif words[0] == 'alloc':
+                if len(words) > 1 and words[1] not in ('on', 'off'):
+                    raise ValueError("expected 'alloc on' or 'alloc off'")
+                self.toggle_allocations(words[1] == 'on' if len(words) > 1 else None)
+            elif words[0] != 'status':
+                return 'error: unknown command {}'.format(words[0])
+        except ValueError as error:
+            return 'error: {}'.format(error)
+        return self.status()
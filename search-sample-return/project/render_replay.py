@@ -0,0 +1,139 @@
+import argparse
+import shutil
+import subprocess
+from collections import deque
+from multiprocessing import Pool, cpu_count
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from perception import calibration_points, color_thresh, find_rock_blobs, \
+    find_rocks, perspective_transform, pix_to_world, rover_coords, update_worldmap
+from robot_log import iter_frames
+from rover_state import load_ground_truth
+from supporting_functions import MapRenderer
+
+# Mosaic layout: camera & warped view on top,
+# world map & label view on the bottom
+IMAGE_SHAPE = (160, 320)
+MAP_SIZE = 200
+FRAME_SHAPE = (IMAGE_SHAPE[0] + MAP_SIZE, 2 * IMAGE_SHAPE[1], 3)
+LABEL_ROW = IMAGE_SHAPE[0] + (MAP_SIZE - IMAGE_SHAPE[0]) // 2
+
+
+# =====================================================
+# ---> Frame Processing
+# =====================================================
+
+
+def process_frame(frame):
+    """Runs the mapping pipeline on one logged frame. Returns the top
+    row of the mosaic, the label view and the world cells (ys, xs) of
+    the navigable terrain, obstacles and rocks.
+    Independent of the other frames, so it runs in the worker processes."""
+    path, _, xpos, ypos, yaw = frame
+    image = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+
+    source, destination = calibration_points(image.shape)
+    warped, mask = perspective_transform(image, source, destination)
+    threshed = color_thresh(warped) * mask
+    obs_map = (1 - threshed) * mask
+    rock_map = find_rocks(warped)
+
+    top = np.concatenate((image, warped), axis=1)
+    labels = np.dstack((obs_map, rock_map, threshed)) * 255
+
+    world_size, scale = MAP_SIZE, 10
+    cells = []
+    for xpix, ypix in (rover_coords(threshed), rover_coords(obs_map),
+                       find_rock_blobs(rock_map)[:2]):
+        x_world, y_world = pix_to_world(xpix, ypix, xpos, ypos, yaw, world_size, scale)
+        cells.append((y_world.astype(np.int16), x_world.astype(np.int16)))
+    return top, labels.astype(np.uint8), cells
+
+
+# =====================================================
+# ---> Video Rendering
+# =====================================================
+
+
+def open_encoder(output, fps):
+    """Starts ffmpeg reading raw RGB frames from its stdin."""
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg was not found on the PATH")
+    command = [ffmpeg, '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+               '-s', '{}x{}'.format(FRAME_SHAPE[1], FRAME_SHAPE[0]),
+               '-r', str(fps), '-i', '-',
+               '-c:v', 'libx264', '-pix_fmt', 'yuv420p', output]
+    return subprocess.Popen(command, stdin=subprocess.PIPE)
+
+
+def render_replay(log_path, output, fps=60, workers=None, start=None, end=None):
+    """Renders the mapping video of a recorded run, or of its frames
+    within [start, end) seconds. The log is streamed and frames are
+    processed in parallel with at most 2 frames per worker in flight,
+    then mapped in order and streamed to the encoder, so memory use is
+    constant."""
+    frames = iter_frames(log_path, start, end)
+    workers = workers or cpu_count()
+
+    worldmap = np.zeros((MAP_SIZE, MAP_SIZE, 3), dtype=float)
+    state = SimpleNamespace(worldmap=worldmap, map_touched=None, rocks_touched=None,
+                            samples_pos=([], []), total_time=0, samples_collected=0)
+    _, ground_truth_3d, nav_pix = load_ground_truth()
+    renderer = MapRenderer(ground_truth_3d, tot_map_pix=nav_pix)
+    mosaic = np.zeros(FRAME_SHAPE, dtype=np.uint8)
+
+    encoder = open_encoder(output, fps)
+    count = 0
+    with Pool(workers) as pool:
+        pending = deque()
+        while True:
+            # Keep the workers busy without queueing the whole run
+            for frame in frames:
+                pending.append((frame[1], pool.apply_async(process_frame, (frame,))))
+                if len(pending) == 2 * workers:
+                    break
+            if not pending:
+                break
+            frame_time, result = pending.popleft()
+            top, labels, cells = result.get()
+            nav, obs, (rock_y, rock_x) = cells
+
+            state.map_touched = update_worldmap(worldmap, nav, obs)
+            worldmap[rock_y, rock_x, 1] += 255
+            state.rocks_touched = (rock_y, rock_x) if len(rock_y) else None
+            state.total_time = frame_time
+            renderer.update(state)
+
+            mosaic[:IMAGE_SHAPE[0]] = top
+            mosaic[IMAGE_SHAPE[0]:, :MAP_SIZE] = renderer.canvas
+            mosaic[LABEL_ROW:LABEL_ROW + IMAGE_SHAPE[0], IMAGE_SHAPE[1]:] = labels
+            encoder.stdin.write(mosaic.tobytes())
+            count += 1
+
+    encoder.stdin.close()
+    if encoder.wait() != 0:
+        raise RuntimeError("ffmpeg failed to encode {}".format(output))
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render the mapping video of a recorded run')
+    parser.add_argument('log', type=str, help='Path to the robot_log.csv of the run.')
+    parser.add_argument('output', type=str, help='Path of the video to write.')
+    parser.add_argument('--fps', type=int, default=60, help='Frame rate of the video.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes, defaults to the number of cores.')
+    parser.add_argument('--start', type=float, default=None,
+                        help='Seconds into the run to start rendering at.')
+    parser.add_argument('--end', type=float, default=None,
+                        help='Seconds into the run to stop rendering at.')
+    args = parser.parse_args()
+
+    count = render_replay(args.log, args.output, args.fps, args.workers,
+                          args.start, args.end)
+    print("Rendered {} frames to {}".format(count, args.output))
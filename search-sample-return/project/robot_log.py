@@ -0,0 +1,163 @@
+import os
+import re
+
+import numpy as np
+
+# Numeric columns of robot_log.csv: (header, key, dtype)
+COLUMNS = (
+    ('SteerAngle', 'steer', np.float32),
+    ('Throttle', 'throttle', np.float32),
+    ('Brake', 'brake', np.float32),
+    ('Speed', 'speed', np.float32),
+    ('X_Position', 'x', np.float64),
+    ('Y_Position', 'y', np.float64),
+    ('Pitch', 'pitch', np.float64),
+    ('Yaw', 'yaw', np.float64),
+    ('Roll', 'roll', np.float64),
+)
+
+# Frame rate of the simulator recordings, used when the image
+# names hold no timestamps
+RECORDING_FPS = 25
+
+# Timestamp in the image names, e.g. robocam_2017_05_02_11_16_21_421.jpg
+STAMP = re.compile(r'(\d{4})_(\d{2})_(\d{2})_(\d{2})_(\d{2})_(\d{2})_(\d{3})\.\w+$')
+
+
+# =====================================================
+# ---> Parsing
+# =====================================================
+
+
+def image_times(paths):
+    """Returns the timestamps (seconds since the epoch) in the image
+    names, or None if any name has none."""
+    stamps = []
+    for path in paths:
+        match = STAMP.search(path)
+        if match is None:
+            return None
+        stamps.append('{}-{}-{}T{}:{}:{}.{}'.format(*match.groups()))
+    return np.array(stamps, dtype='datetime64[ms]').astype(np.int64) / 1000.0
+
+
+class ImageResolver:
+    """Resolves the logged image paths, relative to the folder the
+    recording was made from, falling back to the IMG folder next to the
+    log when the recording was moved. Existence is checked against one
+    listing per folder instead of a stat per image."""
+
+    def __init__(self, log_path):
+        self.log_dir = os.path.dirname(os.path.abspath(log_path))
+        self.base_dir = os.path.dirname(self.log_dir)
+        self.fallback_dir = os.path.join(self.log_dir, 'IMG')
+        self.listings = {}  # Folder -> set of file names
+
+    def listing(self, directory):
+        if directory not in self.listings:
+            try:
+                self.listings[directory] = set(os.listdir(directory))
+            except OSError:
+                self.listings[directory] = set()
+        return self.listings[directory]
+
+    def resolve(self, paths):
+        """Returns the resolved paths and a mask of the existing images."""
+        resolved = []
+        valid = np.zeros(len(paths), dtype=bool)
+        for index, path in enumerate(paths):
+            # Logs recorded on Windows use backslashes
+            path = path.replace('\\', '/')
+            full = os.path.normpath(os.path.join(self.base_dir, path))
+            directory, name = os.path.split(full)
+            if name in self.listing(directory):
+                valid[index] = True
+            elif name in self.listing(self.fallback_dir):
+                full = os.path.join(self.fallback_dir, name)
+                valid[index] = True
+            resolved.append(full)
+        return np.array(resolved), valid
+
+
+# =====================================================
+# ---> Loading
+# =====================================================
+
+
+def iter_robot_log(log_path, start=None, end=None, chunk_rows=65536):
+    """Streams a robot_log.csv in chunks of chunk_rows rows. Yields dicts of
+    typed arrays: 'path' (resolved), 'valid' (image exists), 'time'
+    (seconds since the first frame) and the COLUMNS keys.
+    Only the rows with start <= time < end are kept, reading stops
+    once past end."""
+    resolver = ImageResolver(log_path)
+    with open(log_path, newline='') as log_file:
+        header = log_file.readline().strip().split(';')
+        path_col = header.index('Path')
+        value_cols = [header.index(name) for name, _, _ in COLUMNS]
+
+        first_time = None
+        row_count = 0
+        while True:
+            lines = [line for line in (log_file.readline() for _ in range(chunk_rows))
+                     if line.strip()]
+            if not lines:
+                return
+            rows = [line.rstrip('\r\n').split(';') for line in lines]
+
+            # The simulator writes ',' as the decimal mark under some
+            # locales. ';' separates the fields, so a ',' is always one
+            text = ';'.join(';'.join(row[col] for col in value_cols) for row in rows)
+            text = text.replace(',', '.')
+            values = np.array(text.split(';'), dtype=np.float64).reshape(len(rows), -1)
+
+            raw_paths = [row[path_col] for row in rows]
+            times = image_times(raw_paths)
+            if times is None:
+                times = (row_count + np.arange(len(rows))) / RECORDING_FPS
+            else:
+                first_time = times[0] if first_time is None else first_time
+                times = times - first_time
+            row_count += len(rows)
+
+            keep = np.ones(len(rows), dtype=bool)
+            if start is not None:
+                keep &= times >= start
+            if end is not None:
+                keep &= times < end
+            if keep.any():
+                chunk = {'time': times[keep]}
+                for index, (_, key, dtype) in enumerate(COLUMNS):
+                    chunk[key] = values[keep, index].astype(dtype)
+                chunk['path'], chunk['valid'] = resolver.resolve(
+                    [path for path, kept in zip(raw_paths, keep) if kept])
+                yield chunk
+            if end is not None and times[-1] >= end:
+                return
+
+
+def load_robot_log(log_path, start=None, end=None, chunk_rows=65536):
+    """Loads a robot_log.csv (or its rows within [start, end) seconds)
+    into one dict of typed arrays, see iter_robot_log()."""
+    chunks = list(iter_robot_log(log_path, start, end, chunk_rows))
+    keys = ('time', 'path', 'valid') + tuple(key for _, key, _ in COLUMNS)
+    if not chunks:
+        empty = {'path': np.array([], dtype=str), 'valid': np.zeros(0, dtype=bool),
+                 'time': np.zeros(0)}
+        empty.update({key: np.zeros(0, dtype=dtype) for _, key, dtype in COLUMNS})
+        return empty
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in keys}
+
+
+def iter_frames(log_path, start=None, end=None):
+    """Yields (image path, time, x, y, yaw) of the logged frames whose image
+    exists, streaming the log. Prints the count of missing images."""
+    missing = 0
+    for chunk in iter_robot_log(log_path, start, end):
+        missing += np.count_nonzero(~chunk['valid'])
+        for index in np.flatnonzero(chunk['valid']):
+            yield (str(chunk['path'][index]), float(chunk['time'][index]),
+                   float(chunk['x'][index]), float(chunk['y'][index]),
+                   float(chunk['yaw'][index]))
+    if missing:
+        print("Skipped {} frames with missing images in {}".format(missing, log_path))
@@ -0,0 +1,66 @@
+import numpy as np
+
+
+# =====================================================
+# ---> Rock Tracker
+# =====================================================
+
+
+class RockTracker:
+    """Small persistent table of rock samples seen by the Rover.
+    Detections (blob centroids in world coordinates) are matched to the
+    closest known rock, so a rock keeps its identity across frames and
+    is retained for a while after it goes out of view."""
+
+    def __init__(self, match_dist=3.0, max_age=50):
+        self.match_dist = match_dist  # Max distance (meters) to match a rock
+        self.max_age = max_age  # Frames a rock is kept after it was last seen
+        self.frame = 0  # Running frame index
+        self.next_id = 0  # Id of the next new rock
+        self.tracks = []  # One dict per rock, see update()
+
+    def update(self, world_x, world_y, areas):
+        """Adds the detections of the current frame and drops the rocks
+        that have not been seen for more than max_age frames."""
+        self.frame += 1
+
+        for x, y, area in zip(world_x, world_y, areas):
+            track = self.closest(x, y, self.match_dist)
+            if track is None:
+                self.tracks.append({'id': self.next_id, 'pos': np.array([x, y]),
+                                    'area': area, 'hits': 1,
+                                    'last_seen': self.frame})
+                self.next_id += 1
+                continue
+            # Running average of the position, weighted by blob area
+            # since small (far away) blobs are less accurate
+            weight = area / (track['area'] + area)
+            track['pos'] += weight * (np.array([x, y]) - track['pos'])
+            track['area'] = max(track['area'], area)
+            track['hits'] += 1
+            track['last_seen'] = self.frame
+
+        self.tracks = [track for track in self.tracks
+                       if self.frame - track['last_seen'] <= self.max_age]
+
+    def closest(self, x, y, max_dist=np.inf):
+        """Returns the tracked rock closest to (x, y) within max_dist."""
+        best, best_dist = None, max_dist
+        for track in self.tracks:
+            dist = np.hypot(track['pos'][0] - x, track['pos'][1] - y)
+            if dist <= best_dist:
+                best, best_dist = track, dist
+        return best
+
+    def get(self, track_id):
+        """Returns the tracked rock with the given id, if still tracked."""
+        for track in self.tracks:
+            if track['id'] == track_id:
+                return track
+        return None
+
+    def remove_near(self, x, y, radius):
+        """Forgets the rocks within radius of (x, y), e.g. once collected."""
+        self.tracks = [track for track in self.tracks
+                       if np.hypot(track['pos'][0] - x,
+                                   track['pos'][1] - y) > radius]
@@ -0,0 +1,199 @@
+import hashlib
+import os
+
+import numpy as np
+
+from clearance import ClearanceMap
+from frontier import FrontierIndex
+from rock_tracker import RockTracker
+
+# Ground truth map of the simulator world
+GROUND_TRUTH_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 '..', 'calibration_images', 'map_bw.png')
+# Decoded ground truth arrays, keyed on the hash of the PNG
+GROUND_TRUTH_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  '__pycache__', 'ground_truth_{}.npz')
+
+_ground_truth = None
+
+
+def read_ground_truth(path):
+    """Decodes the ground truth PNG. Returns the map, its 3-channel green
+    version and its count of navigable cells."""
+    import matplotlib.image as mpimg
+
+    # Read in ground truth map and create 3-channel green version for overplotting
+    # NOTE: images are read in by default with the origin (0, 0) in the upper left
+    # and y-axis increasing downward.
+    ground_truth = mpimg.imread(path)
+    # This next line creates arrays of zeros in the red and blue channels
+    # and puts the map into the green channel.  This is why the underlying
+    # map output looks green in the display image
+    ground_truth_3d = np.dstack(
+        (ground_truth * 0, ground_truth * 255, ground_truth * 0)).astype(float)
+    nav_pix = np.count_nonzero(ground_truth_3d[:, :, 1])
+    return ground_truth, ground_truth_3d, nav_pix
+
+
+def load_ground_truth():
+    """Returns (ground_truth, ground_truth_3d, nav_pix), see read_ground_truth().
+    Loaded once per process, from a cache of the decoded arrays while the
+    PNG is unchanged, so matplotlib is only imported to rebuild the cache."""
+    global _ground_truth
+    if _ground_truth is not None:
+        return _ground_truth
+
+    with open(GROUND_TRUTH_PATH, 'rb') as png:
+        digest = hashlib.sha1(png.read()).hexdigest()
+    cache_path = GROUND_TRUTH_CACHE.format(digest)
+    try:
+        with np.load(cache_path) as cache:
+            _ground_truth = (cache['ground_truth'], cache['ground_truth_3d'],
+                             int(cache['nav_pix']))
+        return _ground_truth
+    except (OSError, KeyError, ValueError):
+        pass
+
+    _ground_truth = read_ground_truth(GROUND_TRUTH_PATH)
+    ground_truth, ground_truth_3d, nav_pix = _ground_truth
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial cache
+        tmp_path = cache_path + '.tmp.npz'
+        np.savez(tmp_path, ground_truth=ground_truth, ground_truth_3d=ground_truth_3d,
+                 nav_pix=nav_pix)
+        os.replace(tmp_path, cache_path)
+    except OSError as error:
+        print("Ground truth cache not written: {}".format(error))
+    return _ground_truth
+
+
+# Define RoverState() class to retain rover state parameters
+class RoverState:
+    # Define RoverState() class to retain rover state parameters
+    def __init__(self):
+        self.start_time = None  # To record the start time of navigation
+        self.time_offset = 0  # Navigation time before a resume
+        self.total_time = None  # To record total duration of navigation
+        self.img = None  # Current camera image
+        self.pos = None  # Current position (x, y)
+        self.yaw = None  # Current yaw angle
+        self.pitch = None  # Current pitch angle
+        self.roll = None  # Current roll angle
+        self.vel = None  # Current velocity
+        self.steer = 0  # Current steering angle
+        self.throttle = 0  # Current throttle value
+        self.brake = 0  # Current brake value
+        # Angular histogram of navigable terrain pixels (see perception.py)
+        self.nav_hist_counts = None  # Pixel count per angle bin
+        self.nav_hist_dists = None  # Mean pixel distance per angle bin
+        self.nav_count = 0  # Total count of navigable terrain pixels
+        self.steer_mode = 'mean'  # Steer to the 'mean' angle or 'widest_gap'
+        self.gap_min_count = 10  # Minimum pixel count of a free angle bin
+        self.gap_min_dist = 20  # Minimum mean pixel distance of a free angle bin
+        self.rock_angle = None  # Angle (radians) to the targeted rock
+        self.rock_dists = None  # Distance (pixels) to the targeted rock
+        self.rock_tracker = RockTracker()  # Rocks seen, in world coordinates
+        self.rock_target = None  # Id of the targeted rock in rock_tracker
+        # Rocks the Rover keeps getting stuck on, see rock_stuck() in decision.py
+        self.rock_max_stuck = 3  # Times stuck on the way before giving up on a rock
+        self.rock_give_up_time = 30.0  # Seconds a given up rock is skipped
+        self.rock_stuck_count = 0  # Times stuck on the way to the rock at rock_stuck_pos
+        self.rock_stuck_pos = None  # World position (x, y) of the rock last stuck on
+        self.rocks_given_up = []  # (x, y, time until skipped) of the given up rocks
+        _, ground_truth_3d, nav_pix = load_ground_truth()
+        self.ground_truth = ground_truth_3d  # Ground truth worldmap
+        self.ground_truth_pix = nav_pix  # Count of navigable ground truth cells
+        self.fps = 0
+        self.mode = 'forward'  # Current mode (can be forward or stop)
+        self.throttle_set = 0.4  # Throttle setting when accelerating
+        self.brake_set = 1  # Brake setting when braking
+        # The stop_forward and go_forward fields below represent total count
+        # of navigable terrain pixels.  This is a very crude form of knowing
+        # when you can keep going and when you should stop.  Feel free to
+        # get creative in adding new fields or modifying these!
+        self.stop_forward = 260  # Threshold to initiate stopping
+        self.go_forward = 275  # Threshold to go forward again
+        self.max_vel = 2.4  # Maximum velocity (meters/second)
+        # Image output from perception step
+        # Update this image to display your intermediate analysis steps
+        # on screen in autonomous mode
+        self.vision_image = np.zeros((160, 320, 3), dtype=float)
+        # Worldmap
+        # Update this image with the positions of navigable terrain
+        # obstacles and rock samples
+        self.worldmap = np.zeros((200, 200, 3), dtype=float)
+        # Worldmap cells (ys, xs) updated by the last perception step
+        self.map_touched = None  # Navigable & obstacle cells
+        self.rocks_touched = None  # Rock sample cells
+        # Renders the worldmap inset, see create_output_images()
+        self.map_renderer = None
+        # Known navigable cells next to unexplored ones
+        self.frontier = FrontierIndex(self.worldmap.shape[0])
+        # Distance (cells) to the nearest mapped obstacle
+        self.clearance = ClearanceMap(self.worldmap.shape[0])
+        self.samples_pos = None  # To store the actual sample positions
+        self.samples_to_find = 0  # To store the initial count of samples
+        self.samples_located = 0  # To store number of samples located on map
+        self.samples_collected = 0  # To count the number of samples collected
+        self.samples_seen = set()  # Indices of samples_pos detected by the camera
+        self.samples_picked = set()  # Indices of samples_pos picked up
+        # Will be set to telemetry value data["near_sample"]
+        self.near_sample = 0
+        # Will be set to telemetry value data["picking_up"]
+        self.picking_up = 0
+        self.send_pickup = False  # Set to True to trigger rock pickup
+
+        # Helps clean up the console output
+        self.console_log_counter = 0
+
+        #  Counter to Check if Rover is Stuck
+        self.stuck_count = 0
+        self.stuck_in_stuck_counter = 0
+
+        # Counter to Check is ROver is stuck in a circle
+        self.cut_out_count = 0
+        # Frontier position (x, y) steered to while cutting out
+        self.cut_out_target = None
+        # Used for randomized cutting out of large turns.
+        self.steer_cut_index = 0
+        self.steer_cuts = [14, 14, 14, 10, -14, -14]
+        # Smallest frontier (in cells) worth cutting out toward
+        self.frontier_min_size = 5
+        # Steering toward the nearest frontier, see frontier_bias() in decision.py
+        self.frontier_gain = 0.2  # Degrees of steering per degree of bearing to the frontier
+        self.frontier_min_dist = 10  # Distance (meters) of the frontier cells considered
+        self.stop_turn = None  # Steering of the turn in place in stop mode
+        # Steering away from walls, see clearance_bias() in decision.py
+        self.clearance_gain = 1.5  # Degrees of steering per cell of clearance difference
+        self.clearance_probe_dist = 4  # Distance (meters) of the probes ahead
+        self.clearance_probe_angle = 30  # Angle (degrees) of the probes off the heading
+
+        # Path planning to remembered rocks & back to the start position
+        self.home_pos = None  # Start position (x, y)
+        self.planner = None  # DStarLite planner toward the current goal
+        self.planner_budget = 0.01  # Planning time per frame (seconds)
+        self.goal_lookahead = 5  # Cells along the path to steer toward
+        self.goal_reached_dist = 2.0  # Distance (meters) to consider a goal reached
+        self.home_retry_delay = 20.0  # Seconds of exploring before replanning an unreachable home
+        self.home_retry_time = 0  # Time at which to plan home again
+        self.goal_max_stuck = 3  # Times stuck on the way before dropping a goal
+        self.goal_stuck_count = 0  # Times stuck on the way to the current goal
+
+        # Only warp & classify the ROI of the camera image
+        self.roi_only = False
+        # Skip mapping of frames that barely differ from the last mapped one
+        self.map_gate = True
+        self.map_gate_dist = 0.1  # Minimum move (meters) to map again
+        self.map_gate_yaw = 1.0  # Minimum turn (degrees) to map again
+        self.map_gate_diff = 0.02  # Minimum fraction of changed labels
+        self.map_decimation = 10  # Map at least every n-th gated frame
+        self.last_map_pose = None  # Pose (x, y, yaw) of the last mapped frame
+        self.last_map_labels = None  # Navigable labels of the last mapped frame
+        self.frames_since_map = 0
+        # Skip mapping while tilted, the flat ground projection is invalid
+        self.map_max_pitch = 1.0  # Maximum pitch (degrees) to map
+        self.map_max_roll = 1.0  # Maximum roll (degrees) to map
+        self.map_accepted = 0  # Frames projected into the worldmap
+        self.map_rejected_pose = 0  # Frames skipped for pitch/roll
+        self.map_rejected_stale = 0  # Frames skipped for adding nothing new
@@ -7,6 +7,8 @@ import cv2
 import numpy as np
 from PIL import Image
 
+from tiled_map import TiledWorldMap
+
 
 # Define a function to convert telemetry strings to float independent of decimal convention
 
@@ -25,14 +27,17 @@ def update_rover(Rover, data):
     Rover.console_log_counter += 1
 
     if Rover.start_time is None:
-        Rover.start_time = time.time()
-        Rover.total_time = 0
+        # Continue the clock of a resumed run
+        Rover.start_time = time.time() - Rover.time_offset
+        Rover.total_time = Rover.time_offset
         samples_xpos = ([convert_to_float(pos.strip())
                          for pos in data["samples_x"].split(';')])
         samples_ypos = ([convert_to_float(pos.strip())
                          for pos in data["samples_y"].split(';')])
         Rover.samples_pos = (samples_xpos, samples_ypos)
-        Rover.samples_to_find = int(data["sample_count"])
+        # A resumed run keeps the count of its initial samples
+        if not Rover.samples_to_find:
+            Rover.samples_to_find = int(data["sample_count"])
     # Or just update elapsed time
     else:
         tot_time = time.time() - Rover.start_time
@@ -100,96 +105,201 @@ def update_rover(Rover, data):
     return Rover, image
 
 
+# Rows at the top of the displayed map covered by the text overlay
+TEXT_ROWS = 95
+# Half size (pixels) of the markers of located rock samples
+ROCK_SIZE = 2
+
+
+class MapRenderer:
+    """Renders the worldmap inset blended with the ground truth map.
+    Keeps a cached uint8 ground truth layer and a persistent canvas,
+    so each frame only re-blends the worldmap cells changed since the
+    last render and redraws the text only when its values change."""
+
+    def __init__(self, ground_truth, scale_tol=0.05, tot_map_pix=None):
+        self.size = ground_truth.shape[0]
+        # Ground truth at half intensity, as overlaid by cv2.addWeighted()
+        self.base = np.clip(ground_truth * 0.5, 0, 255).astype(np.uint8)
+        self.truth = ground_truth[:, :, 1] > 0
+        if tot_map_pix is None:
+            tot_map_pix = np.count_nonzero(self.truth)
+        self.tot_map_pix = float(tot_map_pix)
+        # Relative change of the normalization that triggers a full render
+        self.scale_tol = scale_tol
+
+        # Displayed map (y-axis pointing up) without & with the text
+        self.map_layer = None
+        self.canvas = None
+        self.text = None
+        self.text_mask = np.zeros((self.size, self.size), dtype=bool)
+        self.encoded = None
+
+        # Worldmap values (obstacle, navigable) the statistics account for
+        self.accounted = np.zeros((self.size, self.size, 2))
+        self.sums = np.zeros(2)  # Sum of the positive values per channel
+        self.counts = np.zeros(2)  # Count of the positive values per channel
+        self.good_nav_pix = 0
+        self.scales = None  # Normalization of the rendered cells
+        self.located = set()  # Indices of the located samples
+
+    def account(self, worldmap, ys, xs):
+        """Updates the running sums & counts with the new values of the
+        cells (ys, xs), which must not hold duplicates."""
+        old = self.accounted[ys, xs]
+        new = worldmap[ys, xs][:, [0, 2]]
+        self.sums += np.where(new > 0, new, 0).sum(axis=0) \
+            - np.where(old > 0, old, 0).sum(axis=0)
+        self.counts += (new > 0).sum(axis=0) - (old > 0).sum(axis=0)
+        truth = self.truth[ys, xs]
+        self.good_nav_pix += np.count_nonzero((new[:, 1] > 0) & truth) \
+            - np.count_nonzero((old[:, 1] > 0) & truth)
+        self.accounted[ys, xs] = new
+
+    def current_scales(self):
+        """Scales normalizing the mean positive value of each channel to 255."""
+        return np.divide(255, self.sums / np.maximum(self.counts, 1),
+                         out=np.ones(2), where=self.sums > 0)
+
+    def blend(self, worldmap, ys, xs):
+        """Re-blends the cells (ys, xs) into the map layer."""
+        values = worldmap[ys, xs][:, [0, 2]] * self.scales
+        obstacle, navigable = values[:, 0], values[:, 1]
+        obstacle[navigable >= obstacle] = 0
+        plot = np.zeros((len(ys), 3))
+        plot[:, 0] = obstacle
+        plot[:, 2] = navigable
+        plot = plot.clip(0, 255) + self.base[ys, xs]
+        self.map_layer[self.size - 1 - ys, xs] = plot.clip(0, 255).astype(np.uint8)
+
+    def refresh(self, rows, cols):
+        """Copies part of the map layer to the canvas, keeping the text."""
+        self.canvas[rows, cols] = np.where(self.text_mask[rows, cols, None], 255,
+                                           self.map_layer[rows, cols])
+
+    def update(self, Rover):
+        """Brings the canvas up to date with the Rover's worldmap.
+        Returns True if the canvas changed."""
+        worldmap, factor = display_map(Rover.worldmap)
+        changed = False
+
+        if self.map_layer is None:
+            # First render: account & blend every cell
+            ys, xs = np.indices((self.size, self.size))
+            ys, xs = ys.ravel(), xs.ravel()
+            self.account(worldmap, ys, xs)
+            self.map_layer = np.flipud(self.base).copy()
+            self.canvas = self.map_layer.copy()
+            self.scales = self.current_scales()
+            self.blend(worldmap, ys, xs)
+            self.refresh(slice(None), slice(None))
+            rock_cells = [cells * factor for cells in worldmap[:, :, 1].nonzero()]
+            changed = True
+        else:
+            rock_cells = Rover.rocks_touched
+            if Rover.map_touched is not None:
+                touched_ys, touched_xs = (cells // factor for cells in Rover.map_touched)
+                flat = np.unique(touched_ys * self.size + touched_xs)
+                ys, xs = np.divmod(flat, self.size)
+                self.account(worldmap, ys, xs)
+
+                scales = self.current_scales()
+                if np.any(np.abs(scales - self.scales) > self.scale_tol * self.scales):
+                    # Normalization drifted: re-blend the whole map
+                    self.scales = scales
+                    ys, xs = np.indices((self.size, self.size))
+                    self.blend(worldmap, ys.ravel(), xs.ravel())
+                    self.refresh(slice(None), slice(None))
+                else:
+                    self.blend(worldmap, ys, xs)
+                    self.refresh(self.size - 1 - ys, xs)
+                changed = True
+
+        # Check new rock detections against the known sample positions
+        if rock_cells is not None and len(rock_cells[0]) > 0:
+            for idx in range(len(Rover.samples_pos[0])):
+                if idx in self.located:
+                    continue
+                rock_sample_dists = np.sqrt((Rover.samples_pos[0][idx] - rock_cells[1]) ** 2 +
+                                            (Rover.samples_pos[1][idx] - rock_cells[0]) ** 2)
+                # If rocks were detected within 3 meters of known sample positions
+                # consider it a success and mark the known sample on the map
+                if np.min(rock_sample_dists) < 3:
+                    self.located.add(idx)
+                    changed = True
+
+        # Markers of the located samples, redrawn as cells under them may change
+        for idx in self.located if changed else ():
+            rock_x = int(Rover.samples_pos[0][idx] / factor)
+            rock_y = self.size - int(Rover.samples_pos[1][idx] / factor)
+            rows = slice(max(rock_y - ROCK_SIZE, 0), max(rock_y + ROCK_SIZE, 0))
+            cols = slice(max(rock_x - ROCK_SIZE, 0), max(rock_x + ROCK_SIZE, 0))
+            self.map_layer[rows, cols] = 255
+            self.refresh(rows, cols)
+
+        # Calculate some statistics on the map results
+        tot_nav_pix = self.counts[1]
+        perc_mapped = round(100 * self.good_nav_pix / max(self.tot_map_pix, 1), 1)
+        if tot_nav_pix > 0:
+            fidelity = round(100 * self.good_nav_pix / tot_nav_pix, 1)
+        else:
+            fidelity = 0
+
+        # Redraw the text only if one of its values changed
+        text = ("Time: " + str(np.round(Rover.total_time, 1)) + ' s',
+                "Mapped: " + str(perc_mapped) + '%',
+                "Fidelity: " + str(fidelity) + '%',
+                "Rocks",
+                "  Located: " + str(len(self.located)),
+                "  Collected: " + str(Rover.samples_collected))
+        if text != self.text:
+            self.text = text
+            text_image = np.zeros((TEXT_ROWS, self.size), dtype=np.uint8)
+            for line, string in enumerate(text):
+                cv2.putText(text_image, string, (0, 10 + 15 * line),
+                            cv2.FONT_HERSHEY_COMPLEX, 0.4, 255, 1)
+            self.text_mask[:TEXT_ROWS] = text_image > 0
+            self.refresh(slice(0, TEXT_ROWS), slice(None))
+            changed = True
+
+        return changed
+
+    def render(self, Rover):
+        """Updates the canvas and returns it as a base64 JPEG string."""
+        # Only encode again if the canvas changed
+        if self.update(Rover) or self.encoded is None:
+            pil_img = Image.fromarray(self.canvas)
+            buff = BytesIO()
+            pil_img.save(buff, format="JPEG")
+            self.encoded = base64.b64encode(buff.getvalue()).decode("utf-8")
+        return self.encoded
+
+
+def display_map(worldmap):
+    """Returns the dense map to display for a worldmap and its scale
+    (worldmap cells per displayed cell). Large tiled worldmaps are
+    displayed from their coarse overview."""
+    if isinstance(worldmap, TiledWorldMap):
+        return worldmap.overview, worldmap.overview_factor
+    return worldmap, 1
+
+
 # Define a function to create display output given worldmap results
 
 
 def create_output_images(Rover):
-    # Create a scaled map for plotting and clean up obs/nav pixels a bit
-    if np.max(Rover.worldmap[:, :, 2]) > 0:
-        nav_pix = Rover.worldmap[:, :, 2] > 0
-        navigable = Rover.worldmap[:, :, 2] * \
-                    (255 / np.mean(Rover.worldmap[nav_pix, 2]))
-    else:
-        navigable = Rover.worldmap[:, :, 2]
-    if np.max(Rover.worldmap[:, :, 0]) > 0:
-        obs_pix = Rover.worldmap[:, :, 0] > 0
-        obstacle = Rover.worldmap[:, :, 0] * \
-                   (255 / np.mean(Rover.worldmap[obs_pix, 0]))
-    else:
-        obstacle = Rover.worldmap[:, :, 0]
-
-    likely_nav = navigable >= obstacle
-    obstacle[likely_nav] = 0
-    plotmap = np.zeros_like(Rover.worldmap)
-    plotmap[:, :, 0] = obstacle
-    plotmap[:, :, 2] = navigable
-    plotmap = plotmap.clip(0, 255)
-    # Overlay obstacle and navigable terrain map with ground truth map
-    map_add = cv2.addWeighted(plotmap, 1, Rover.ground_truth, 0.5, 0)
-
-    # Check whether any rock detections are present in worldmap
-    rock_world_pos = Rover.worldmap[:, :, 1].nonzero()
-    # If there are, we'll step through the known sample positions
-    # to confirm whether detections are real
-    samples_located = 0
-    if rock_world_pos[0].any():
-
-        rock_size = 2
-        for idx in range(len(Rover.samples_pos[0])):
-            test_rock_x = Rover.samples_pos[0][idx]
-            test_rock_y = Rover.samples_pos[1][idx]
-            rock_sample_dists = np.sqrt((test_rock_x - rock_world_pos[1]) ** 2 +
-                                        (test_rock_y - rock_world_pos[0]) ** 2)
-            # If rocks were detected within 3 meters of known sample positions
-            # consider it a success and plot the location of the known
-            # sample on the map
-            if np.min(rock_sample_dists) < 3:
-                samples_located += 1
-                # Convert indices to integers
-                test_rock_x_int = int(test_rock_x)
-                test_rock_y_int = int(test_rock_y)
-                map_add[test_rock_y_int - rock_size:test_rock_y_int + rock_size, test_rock_x_int - rock_size:test_rock_x_int + rock_size, :] = 255
-
-    # Calculate some statistics on the map results
-    # First get the total number of pixels in the navigable terrain map
-    tot_nav_pix = float(len((plotmap[:, :, 2].nonzero()[0])))
-    # Next figure out how many of those correspond to ground truth pixels
-    good_nav_pix = float(
-        len(((plotmap[:, :, 2] > 0) & (Rover.ground_truth[:, :, 1] > 0)).nonzero()[0]))
-    # Next find how many do not correspond to ground truth pixels
-    bad_nav_pix = float(len(((plotmap[:, :, 2] > 0) & (
-            Rover.ground_truth[:, :, 1] == 0)).nonzero()[0]))
-    # Grab the total number of map pixels
-    tot_map_pix = float(len((Rover.ground_truth[:, :, 1].nonzero()[0])))
-    # Calculate the percentage of ground truth map that has been successfully found
-    perc_mapped = round(100 * good_nav_pix / tot_map_pix, 1)
-    # Calculate the number of good map pixel detections divided by total pixels
-    # found to be navigable terrain
-    if tot_nav_pix > 0:
-        fidelity = round(100 * good_nav_pix / (tot_nav_pix), 1)
-    else:
-        fidelity = 0
-    # Flip the map for plotting so that the y-axis points upward in the display
-    map_add = np.flipud(map_add).astype(np.float32)
-    # Add some text about map and rock sample detection results
-    cv2.putText(map_add, "Time: " + str(np.round(Rover.total_time, 1)) + ' s', (0, 10),
-                cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    cv2.putText(map_add, "Mapped: " + str(perc_mapped) + '%', (0, 25),
-                cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    cv2.putText(map_add, "Fidelity: " + str(fidelity) + '%', (0, 40),
-                cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    cv2.putText(map_add, "Rocks", (0, 55),
-                cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    cv2.putText(map_add, "  Located: " + str(samples_located), (0, 70),
-                cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    cv2.putText(map_add, "  Collected: " + str(Rover.samples_collected), (0, 85),
-                cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    # Convert map and vision image to base64 strings for sending to server
-    pil_img = Image.fromarray(map_add.astype(np.uint8))
-    buff = BytesIO()
-    pil_img.save(buff, format="JPEG")
-    encoded_string1 = base64.b64encode(buff.getvalue()).decode("utf-8")
+    # Render the worldmap inset, only the cells changed since the last frame
+    if Rover.map_renderer is None:
+        ground_truth, nav_pix = Rover.ground_truth, Rover.ground_truth_pix
+        shown, factor = display_map(Rover.worldmap)
+        if factor != 1 or Rover.worldmap.shape[0] != ground_truth.shape[0]:
+            # No ground truth for this world, or it is shown scaled down
+            ground_truth, nav_pix = np.zeros_like(shown), 0
+        Rover.map_renderer = MapRenderer(ground_truth, tot_map_pix=nav_pix)
+    encoded_string1 = Rover.map_renderer.render(Rover)
+    Rover.samples_located = len(Rover.map_renderer.located)
 
+    # Convert vision image to base64 string for sending to server
     pil_img = Image.fromarray(Rover.vision_image.astype(np.uint8))
     buff = BytesIO()
     pil_img.save(buff, format="JPEG")
@@ -0,0 +1,122 @@
+import numpy as np
+
+
+# =====================================================
+# ---> Tiled World Map
+# =====================================================
+
+
+class TiledWorldMap:
+    """Worldmap split into square tiles that are only allocated once a
+    cell in them is written, so memory grows with the explored area
+    instead of the world size. Also keeps a coarse overview level
+    (sum of each overview_factor x overview_factor block of cells) for
+    rendering & statistics.
+
+    Supports the indexing used on the dense worldmap array:
+    worldmap[ys, xs], worldmap[ys, xs, channel] and in place updates
+    such as worldmap[ys, xs, channel] += value, with integer (array) ys, xs.
+    Unwritten cells read as 0."""
+
+    def __init__(self, world_size, channels=3, tile_size=64, overview_size=200):
+        self.world_size = world_size
+        self.channels = channels
+        self.tile_size = tile_size
+        self.tiles_per_side = -(-world_size // tile_size)
+        self.tiles = {}  # Tile key (ty * tiles_per_side + tx) -> array
+        self.overview_factor = max(1, -(-world_size // overview_size))
+        overview_side = -(-world_size // self.overview_factor)
+        self.overview = np.zeros((overview_side, overview_side, channels))
+
+    @property
+    def shape(self):
+        return self.world_size, self.world_size, self.channels
+
+    @property
+    def nbytes(self):
+        """Memory (bytes) used by the allocated tiles & the overview."""
+        return sum(tile.nbytes for tile in self.tiles.values()) + self.overview.nbytes
+
+    def _split(self, index):
+        """Splits an index into 1d ys & xs arrays and a channel index."""
+        if len(index) == 2:
+            ys, xs = index
+            channel = slice(None)
+        else:
+            ys, xs, channel = index
+        return np.atleast_1d(ys), np.atleast_1d(xs), channel
+
+    def _groups(self, ys, xs):
+        """Yields the tile key and the positions of the cells in each tile."""
+        keys = (ys // self.tile_size) * self.tiles_per_side + xs // self.tile_size
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        bounds = np.flatnonzero(np.diff(sorted_keys)) + 1
+        for group in np.split(order, bounds):
+            if len(group):
+                yield int(keys[group[0]]), group
+
+    def _tile_origin(self, key):
+        ty, tx = divmod(key, self.tiles_per_side)
+        return ty * self.tile_size, tx * self.tile_size
+
+    def gather(self, ys, xs):
+        """Returns the values of all channels of the cells (ys, xs)."""
+        values = np.zeros((len(ys), self.channels))
+        for key, group in self._groups(ys, xs):
+            tile = self.tiles.get(key)
+            if tile is not None:
+                y0, x0 = self._tile_origin(key)
+                values[group] = tile[ys[group] - y0, xs[group] - x0]
+        return values
+
+    def __getitem__(self, index):
+        scalar = np.ndim(index[0]) == 0
+        ys, xs, channel = self._split(index)
+        values = self.gather(ys, xs)[:, channel]
+        return values[0] if scalar else values
+
+    def __setitem__(self, index, new_values):
+        ys, xs, channel = self._split(index)
+        # Overview is updated from the change of each distinct cell
+        flat = np.unique(ys * self.world_size + xs)
+        cell_ys, cell_xs = np.divmod(flat, self.world_size)
+        old = self.gather(cell_ys, cell_xs)
+
+        new_values = np.broadcast_to(new_values, (len(ys),) + np.shape(old[:1, channel])[1:])
+        for key, group in self._groups(ys, xs):
+            tile = self.tiles.get(key)
+            if tile is None:
+                tile = np.zeros((self.tile_size, self.tile_size, self.channels),
+                                dtype=np.float32)
+                self.tiles[key] = tile
+            y0, x0 = self._tile_origin(key)
+            tile[ys[group] - y0, xs[group] - x0, channel] = new_values[group]
+
+        delta = self.gather(cell_ys, cell_xs) - old
+        np.add.at(self.overview, (cell_ys // self.overview_factor,
+                                  cell_xs // self.overview_factor), delta)
+
+    def rebuild_overview(self):
+        """Recomputes the overview from the tiles, e.g. after loading them."""
+        self.overview[:] = 0
+        for y0, x0, tile in self.blocks():
+            ys, xs = np.indices(tile.shape[:2])
+            np.add.at(self.overview, ((ys + y0) // self.overview_factor,
+                                      (xs + x0) // self.overview_factor), tile)
+
+    def blocks(self):
+        """Yields the (y0, x0) origin and the array of each allocated tile."""
+        for key, tile in self.tiles.items():
+            y0, x0 = self._tile_origin(key)
+            # Tiles on the far edges may extend past the world
+            yield y0, x0, tile[:self.world_size - y0, :self.world_size - x0]
+
+
+def map_blocks(worldmap):
+    """Yields the (y0, x0) origin and array of the allocated parts of a
+    worldmap, either a dense array or a TiledWorldMap."""
+    if isinstance(worldmap, TiledWorldMap):
+        yield from worldmap.blocks()
+    else:
+        yield 0, 0, worldmap